@@ -36,6 +36,7 @@ PHOTON_SPECDEPS_DIR=$(SRCROOT)/support/package-builder
 PHOTON_SPECDEPS=$(PHOTON_SPECDEPS_DIR)/SpecDeps.py
 PHOTON_PACKAGE_BUILDER=$(PHOTON_PKG_BUILDER_DIR)/builder.py
 PHOTON_GENERATE_OSS_FILES=$(PHOTON_PKG_BUILDER_DIR)/GenerateOSSFiles.py
+PHOTON_BUILD_HISTORY=$(PHOTON_PKG_BUILDER_DIR)/BuildHistory.py
 ifdef PHOTON_PULLSOURCES_CONFIG
 PHOTON_PULLSOURCES_CONFIG:=$(abspath $(PHOTON_PULLSOURCES_CONFIG))
 else
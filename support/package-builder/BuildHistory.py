@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# pylint: disable=invalid-name,missing-docstring
+#
+# Keeps wall-clock build durations of packages and regenerates
+# packageWeights.json out of them.
+#
+# History file format:
+# {
+#     "<package name>": [
+#         {"version": "1.0", "run": "<run ID>", "time": <epoch>, "total": <seconds>,
+#          "phases": {"sandbox": <seconds>, "dependencies": <seconds>, ...}},
+#         ...
+#     ],
+#     ...
+# }
+#
+# "time" is the end of the build. The run ID identifies the builder run
+# which recorded the build, so that the builds of one run can be told
+# apart from those of other runs.
+
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from argparse import ArgumentParser
+from Logger import Logger
+from constants import constants
+
+class BuildHistory(object):
+
+    lock = threading.Lock()
+    # Number of build records kept per package
+    maxRecordsPerPackage = 10
+    # Smoothing factor of exponentially weighted moving average.
+    # Higher value gives more weight to recent builds.
+    smoothingFactor = 0.5
+    # Start time and pid of this builder run, inherited by worker processes
+    runID = "%d-%d" % (int(time.time()), os.getpid())
+
+    @staticmethod
+    def recordBuild(package, version, phases):
+        if not constants.buildHistoryPath:
+            return
+        record = {"version": version,
+                  "run": BuildHistory.runID,
+                  "time": int(time.time()),
+                  "total": round(sum(phases.values()), 1),
+                  "phases": {k: round(v, 1) for k, v in phases.items()}}
+        with BuildHistory.lock:
+            with BuildHistory._lockHistoryFile():
+                history = BuildHistory.readHistory(constants.buildHistoryPath)
+                records = history.setdefault(package, [])
+                records.append(record)
+                del records[:-BuildHistory.maxRecordsPerPackage]
+                BuildHistory._writeHistory(constants.buildHistoryPath, history)
+
+    @staticmethod
+    def readHistory(historyPath):
+        if not os.path.isfile(historyPath):
+            return {}
+        with open(historyPath, 'r') as historyFile:
+            return json.load(historyFile)
+
+    # Returns run ID of the latest recorded build, or None
+    @staticmethod
+    def getLatestRun(history):
+        latestRecord = None
+        for records in history.values():
+            for record in records:
+                if "run" in record and (latestRecord is None or
+                                        record["time"] > latestRecord["time"]):
+                    latestRecord = record
+        if latestRecord is None:
+            return None
+        return latestRecord["run"]
+
+    # Returns map of package name to its last record of given run
+    @staticmethod
+    def getRunRecords(history, runID):
+        runRecords = {}
+        for package, records in history.items():
+            records = [r for r in records if r.get("run") == runID]
+            if records:
+                runRecords[package] = max(records, key=lambda r: r["time"])
+        return runRecords
+
+    # Returns map of package name to estimated build time in seconds
+    @staticmethod
+    def getEstimatedBuildTimes(history, smoothingFactor=None):
+        if smoothingFactor is None:
+            smoothingFactor = BuildHistory.smoothingFactor
+        estimates = {}
+        for package, records in history.items():
+            estimate = None
+            for record in sorted(records, key=lambda r: r["time"]):
+                if estimate is None:
+                    estimate = record["total"]
+                else:
+                    estimate = (smoothingFactor * record["total"] +
+                                (1 - smoothingFactor) * estimate)
+            if estimate is not None:
+                estimates[package] = estimate
+        return estimates
+
+    # Package weights are build times in minutes. Packages without build
+    # history keep their current weights.
+    @staticmethod
+    def updatePackageWeights(historyPath, packageWeightsPath, logger, smoothingFactor=None):
+        history = BuildHistory.readHistory(historyPath)
+        if not history:
+            logger.info("No build history found in " + historyPath)
+            return False
+
+        pkgWeights = {}
+        if os.path.isfile(packageWeightsPath):
+            with open(packageWeightsPath, 'r') as weightFile:
+                pkgWeights = json.load(weightFile)
+
+        estimates = BuildHistory.getEstimatedBuildTimes(history, smoothingFactor)
+        for package, seconds in estimates.items():
+            weight = int(round(seconds / 60))
+            if weight > 0:
+                pkgWeights[package] = weight
+            elif package in pkgWeights:
+                del pkgWeights[package]
+
+        sortedWeights = sorted(pkgWeights.items(), key=lambda x: (-int(x[1]), x[0]))
+        tempFile = packageWeightsPath + "-" + str(os.getpid())
+        with open(tempFile, 'w') as weightFile:
+            weightFile.write("{\n")
+            weightFile.write(",\n".join('  "%s": %d' % (k, int(v)) for k, v in sortedWeights))
+            weightFile.write("\n}\n")
+        os.replace(tempFile, packageWeightsPath)
+        logger.info("Updated " + str(len(estimates)) + " package weights in " +
+                    packageWeightsPath)
+        return True
+
+    # Several builder instances might share the history file
+    @staticmethod
+    def _lockHistoryFile():
+        historyDir = os.path.dirname(constants.buildHistoryPath)
+        if historyDir and not os.path.isdir(historyDir):
+            os.makedirs(historyDir)
+        return _FileLock(constants.buildHistoryPath + ".lock")
+
+    @staticmethod
+    def _writeHistory(historyPath, history):
+        tempFile = historyPath + "-" + str(os.getpid())
+        with open(tempFile, 'w') as historyFile:
+            json.dump(history, historyFile, indent=1, sort_keys=True)
+        os.replace(tempFile, historyPath)
+
+
+class _FileLock(object):
+
+    def __init__(self, lockPath):
+        self.lockPath = lockPath
+        self.lockFile = None
+
+    def __enter__(self):
+        self.lockFile = open(self.lockPath, 'w')
+        fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        self.lockFile.close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("-bh", "--build-history-path", dest="buildHistoryPath",
+                        default="../../stage/build-history.json")
+    parser.add_argument("-pw", "--package-weights-path", dest="packageWeightsPath",
+                        default="../../common/data/packageWeights.json")
+    parser.add_argument("-f", "--smoothing-factor", dest="smoothingFactor",
+                        default=BuildHistory.smoothingFactor, type=float)
+    parser.add_argument("-l", "--log-path", dest="logPath", default="../../stage/LOGS")
+    parser.add_argument("-y", "--log-level", dest="logLevel", default="info")
+    options = parser.parse_args()
+
+    logger = Logger.getLogger("BuildHistory", options.logPath, options.logLevel)
+    if not 0 < options.smoothingFactor <= 1:
+        logger.error("Smoothing factor must be in (0, 1] range")
+        sys.exit(1)
+    BuildHistory.updatePackageWeights(options.buildHistoryPath, options.packageWeightsPath,
+                                      logger, options.smoothingFactor)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
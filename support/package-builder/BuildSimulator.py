@@ -0,0 +1,208 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Discrete-event simulation of a parallel build. Real dependency graph
+# construction and Scheduler priorities are used, but package builds are
+# replaced by a simulated clock, so the effect of --threads or of a
+# scheduling change can be evaluated in seconds.
+
+import heapq
+import threading
+from Logger import Logger
+from constants import constants
+from PackageBuildDataGenerator import PackageBuildDataGenerator
+from Scheduler import Scheduler
+from BuildHistory import BuildHistory
+from SpecData import SPECS
+from StringUtils import StringUtils
+
+class BuildSimulator(object):
+
+    # replayRun is the run ID of the build history replayed, by default
+    # the latest run
+    def __init__(self, logName=None, logPath=None, durationsSource="weights", replayRun=None):
+        if logName is None:
+            logName = "BuildSimulator"
+        if logPath is None:
+            logPath = constants.logPath
+        self.logName = logName
+        self.logPath = logPath
+        # the report is the whole output of a simulation
+        self.logLevel = "debug" if constants.logLevel == "debug" else "info"
+        self.logger = Logger.getLogger(logName, logPath, self.logLevel)
+        self.durationsSource = durationsSource
+        self.replayRun = replayRun
+        # map package name to build duration in seconds, taken from the
+        # build history
+        self.mapPackageToRecordedDuration = {}
+        # map package name to (start time, end time) of its build in the
+        # replayed run
+        self.mapPackageToRecordedBuild = {}
+        # map "name-version" to simulated build duration in seconds
+        self.mapPackageToDuration = {}
+        self.sortedPackageList = []
+        # list of (start time, end time, worker index, package)
+        self.buildLog = []
+
+    # Returns simulated makespan in seconds
+    def simulate(self, listPackages, buildThreads):
+        self._prepare(listPackages)
+
+        Scheduler.setLog(self.logName, self.logPath, self.logLevel)
+        Scheduler.setParams(self.sortedPackageList, set())
+        Scheduler.setEvent(threading.Event())
+        Scheduler.stopScheduling = False
+
+        self.mapPackageToDuration = {}
+        for pkg in self.sortedPackageList:
+            self.mapPackageToDuration[pkg] = self._getDuration(pkg)
+
+        currentTime = 0
+        idleWorkers = list(range(buildThreads))
+        runningBuilds = []
+        self.buildLog = []
+        while True:
+            # hand out the ready packages to the idle workers, lowest
+            # worker index first to keep the simulation deterministic
+            idleWorkers.sort(reverse=True)
+            while idleWorkers:
+                pkg = Scheduler.getNextPackageToBuild()
+                if pkg is None:
+                    break
+                worker = idleWorkers.pop()
+                endTime = currentTime + self.mapPackageToDuration[pkg]
+                heapq.heappush(runningBuilds, (endTime, worker, pkg, currentTime))
+
+            if not runningBuilds:
+                break
+
+            endTime, worker, pkg, startTime = heapq.heappop(runningBuilds)
+            currentTime = endTime
+            self.buildLog.append((startTime, endTime, worker, pkg))
+            Scheduler.notifyPackageBuildCompleted(pkg)
+            idleWorkers.append(worker)
+
+        return currentTime
+
+    def printReport(self, makespan, buildThreads):
+        self.logger.info("Simulated build of " + str(len(self.buildLog)) + " packages using " +
+                         str(buildThreads) + " threads (" + self.durationsSource +
+                         " durations, " + constants.schedulingPolicy + " scheduling policy)")
+        self.logger.info("Predicted makespan: " + self._formatTime(makespan))
+
+        busyTime = [0] * buildThreads
+        for startTime, endTime, worker, _ in self.buildLog:
+            busyTime[worker] += endTime - startTime
+        if makespan > 0:
+            self.logger.info("Worker utilization: " +
+                             "{:.1%}".format(sum(busyTime) / (makespan * buildThreads)))
+            for worker in range(buildThreads):
+                self.logger.info("    WorkerThread" + str(worker) + ": " +
+                                 "{:.1%}".format(busyTime[worker] / makespan))
+
+        if self.durationsSource == "replay":
+            recordedBuilds = []
+            for pkg in self.mapPackageToDuration:
+                packageName, _ = StringUtils.splitPackageNameAndVersion(pkg)
+                if packageName in self.mapPackageToRecordedBuild:
+                    recordedBuilds.append(self.mapPackageToRecordedBuild[packageName])
+            self.logger.info("Replayed " + str(len(recordedBuilds)) + " recorded builds of run " +
+                             str(self.replayRun) + ", " +
+                             str(len(self.mapPackageToDuration) - len(recordedBuilds)) +
+                             " packages use weights")
+            if recordedBuilds:
+                recordedMakespan = (max(end for _, end in recordedBuilds) -
+                                    min(start for start, _ in recordedBuilds))
+                self.logger.info("Recorded makespan of the run: " +
+                                 self._formatTime(recordedMakespan))
+
+        criticalPathLength, criticalPath = self._getCriticalPath()
+        self.logger.info("Critical path: " + self._formatTime(criticalPathLength) +
+                         " (lower bound of makespan)")
+        for pkg in criticalPath:
+            self.logger.info("    " + pkg + " " + self._formatTime(self.mapPackageToDuration[pkg]))
+
+        if not Scheduler.isAllPackagesBuilt():
+            self.logger.error("Packages which could never be scheduled:")
+            self.logger.error(sorted(Scheduler.listOfPackagesToBuild))
+
+    def _prepare(self, listPackages):
+        # Extend listPackages from ["name1", "name2",..] to ["name1-vers1", "name2-vers2",..]
+        listPackageNamesAndVersions = set()
+        for pkg in listPackages:
+            base = SPECS.getData().getSpecName(pkg)
+            for version in SPECS.getData().getVersions(base):
+                listPackageNamesAndVersions.add(base + "-" + version)
+
+        pkgBuildDataGen = PackageBuildDataGenerator(self.logName, self.logPath)
+        _, _, self.sortedPackageList = (
+            pkgBuildDataGen.getPackageBuildData(listPackageNamesAndVersions))
+
+        if self.durationsSource == "weights" or not constants.buildHistoryPath:
+            return
+        history = BuildHistory.readHistory(constants.buildHistoryPath)
+        if self.durationsSource == "history":
+            self.mapPackageToRecordedDuration = BuildHistory.getEstimatedBuildTimes(history)
+            return
+        # replay: durations of the builds of a single run, so that the
+        # recorded makespan is the one of a real build
+        if self.replayRun is None:
+            self.replayRun = BuildHistory.getLatestRun(history)
+        for package, record in BuildHistory.getRunRecords(history, self.replayRun).items():
+            self.mapPackageToRecordedDuration[package] = record["total"]
+            self.mapPackageToRecordedBuild[package] = (record["time"] - record["total"],
+                                                       record["time"])
+
+    # Package weights are build times in minutes
+    def _getDuration(self, pkg):
+        packageName, _ = StringUtils.splitPackageNameAndVersion(pkg)
+        if packageName in self.mapPackageToRecordedDuration:
+            return self.mapPackageToRecordedDuration[packageName]
+        return Scheduler._getWeight(pkg) * 60
+
+    # Longest chain of packages which have to be built one after another,
+    # using the same requires as the Scheduler ready queue.
+    def _getCriticalPath(self):
+        packagesToBuild = set(self.mapPackageToDuration.keys())
+        mapPackageToRequires = {}
+        for pkg in packagesToBuild:
+            requires = Scheduler._getRequiredBasePackages(pkg) & packagesToBuild
+            requires.discard(pkg)
+            mapPackageToRequires[pkg] = requires
+
+        # map package to (length of the longest chain ending with it,
+        # previous package in that chain)
+        chains = {}
+        for pkg in sorted(packagesToBuild):
+            stack = [pkg]
+            while stack:
+                node = stack[-1]
+                if node in chains:
+                    stack.pop()
+                    continue
+                pending = [r for r in mapPackageToRequires[node]
+                           if r not in chains and r not in stack]
+                if pending:
+                    stack.extend(sorted(pending))
+                    continue
+                stack.pop()
+                longest = (0, None)
+                for r in mapPackageToRequires[node]:
+                    if r in chains and chains[r][0] > longest[0]:
+                        longest = (chains[r][0], r)
+                chains[node] = (longest[0] + self.mapPackageToDuration[node], longest[1])
+
+        if not chains:
+            return 0, []
+        lastPkg = max(sorted(chains), key=lambda p: chains[p][0])
+        criticalPathLength = chains[lastPkg][0]
+        criticalPath = []
+        while lastPkg is not None:
+            criticalPath.append(lastPkg)
+            lastPkg = chains[lastPkg][1]
+        criticalPath.reverse()
+        return criticalPathLength, criticalPath
+
+    @staticmethod
+    def _formatTime(seconds):
+        seconds = int(seconds)
+        return "%d:%02d:%02d" % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
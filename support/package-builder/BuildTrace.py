@@ -0,0 +1,132 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Collects a timeline of the build in Chrome trace event format, which can
+# be loaded into chrome://tracing or https://ui.perfetto.dev. Every worker
+# is a track holding a span per package, with nested spans for the build
+# phases. Counter tracks show ready-queue depth and busy workers.
+
+import os
+import re
+import json
+import time
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from constants import constants
+
+class BuildTrace(object):
+
+    lock = threading.Lock()
+    events = []
+    startTime = None
+
+    @staticmethod
+    def initialize():
+        with BuildTrace.lock:
+            BuildTrace.events = []
+            BuildTrace.startTime = time.time()
+
+    @staticmethod
+    def isEnabled():
+        return constants.buildTracePath is not None and BuildTrace.startTime is not None
+
+    # Records a span of the calling worker. Spans of the same worker
+    # which contain each other are shown nested.
+    @staticmethod
+    @contextmanager
+    def span(name, category="phase", **args):
+        if not BuildTrace.isEnabled():
+            yield
+            return
+        startTime = time.time()
+        try:
+            yield
+        finally:
+            event = {"name": name, "cat": category, "ph": "X",
+                     "ts": BuildTrace._getTimestamp(startTime),
+                     "dur": int((time.time() - startTime) * 1000000),
+                     "tid": BuildTrace._getTrackName()}
+            if args:
+                event["args"] = args
+            BuildTrace._addEvent(event)
+
+    @staticmethod
+    def counter(name, values):
+        if not BuildTrace.isEnabled():
+            return
+        BuildTrace._addEvent({"name": name, "ph": "C",
+                              "ts": BuildTrace._getTimestamp(time.time()),
+                              "tid": "MainThread", "args": values})
+
+    # Worker processes hand their events over to the coordinator
+    @staticmethod
+    def popEvents():
+        with BuildTrace.lock:
+            events = BuildTrace.events
+            BuildTrace.events = []
+        return events
+
+    @staticmethod
+    def addEvents(events):
+        with BuildTrace.lock:
+            BuildTrace.events.extend(events)
+
+    @staticmethod
+    def write():
+        if not BuildTrace.isEnabled():
+            return
+        with BuildTrace.lock:
+            events = list(BuildTrace.events)
+
+        # Trace viewers want numeric thread ids: main thread first,
+        # then workers in their numeric order.
+        trackNames = set(event["tid"] for event in events)
+        trackNames.add("MainThread")
+        sortedTrackNames = sorted(trackNames, key=BuildTrace._getTrackSortKey)
+        mapTrackNameToId = {name: i for i, name in enumerate(sortedTrackNames)}
+
+        pid = os.getpid()
+        traceEvents = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                        "args": {"name": "builder"}}]
+        for name, tid in mapTrackNameToId.items():
+            traceEvents.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                                "args": {"name": name}})
+            traceEvents.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": tid,
+                                "args": {"sort_index": tid}})
+        for event in events:
+            event = dict(event, pid=pid, tid=mapTrackNameToId[event["tid"]])
+            traceEvents.append(event)
+
+        traceDir = os.path.dirname(constants.buildTracePath)
+        if traceDir and not os.path.isdir(traceDir):
+            os.makedirs(traceDir)
+        tempFile = constants.buildTracePath + "-" + str(pid)
+        with open(tempFile, 'w') as traceFile:
+            json.dump({"traceEvents": traceEvents, "displayTimeUnit": "ms"}, traceFile)
+        os.replace(tempFile, constants.buildTracePath)
+
+    @staticmethod
+    def _addEvent(event):
+        with BuildTrace.lock:
+            BuildTrace.events.append(event)
+
+    @staticmethod
+    def _getTimestamp(eventTime):
+        return int((eventTime - BuildTrace.startTime) * 1000000)
+
+    # Worker processes are named after the worker thread they serve
+    @staticmethod
+    def _getTrackName():
+        process = multiprocessing.current_process()
+        if process.name != "MainProcess":
+            return process.name
+        return threading.current_thread().name
+
+    @staticmethod
+    def _getTrackSortKey(name):
+        if name == "MainThread":
+            return (0, 0, name)
+        match = re.match(r"^(.*?)(\d+)$", name)
+        if match:
+            return (1, int(match.group(2)), name)
+        return (2, 0, name)
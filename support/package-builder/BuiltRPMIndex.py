@@ -0,0 +1,170 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Index of the RPMs built from the specs: name, EVR, arch, provides,
+# requires, payload size and digest of each RPM file, read from the RPM
+# headers with RPMHeader instead of running rpm -qp. The RPM files of a
+# package are derived from its spec data, so the build log does not have
+# to be scraped for them. Packages are added as their builds finish, and
+# on their first lookup otherwise (e.g. packages built by an earlier run).
+
+import hashlib
+import os.path
+import threading
+from constants import constants
+from SpecData import SPECS
+from RPMHeader import RPMHeader
+from RPMIndex import RPMIndex
+
+class BuiltRPMIndex(object):
+
+    lock = threading.Lock()
+    # map package-version to list of entries of its RPM files
+    mapPackageToEntries = {}
+    # map RPM file path to its entry
+    mapPathToEntry = {}
+    # map provided capability to paths of the RPMs providing it
+    mapProvideToPaths = {}
+
+    # Returns (map of RPM package to RPM file, SRPM file, debuginfo RPM
+    # file) of the files of a package found below the stage directories.
+    # Files which are not built are left out or None.
+    @staticmethod
+    def findPackageFiles(package, version):
+        release = SPECS.getData().getRelease(package, version)
+        mapRPMPackageToFile = {}
+        for rpmPkg in SPECS.getData().getRPMPackages(package, version):
+            rpmFile = BuiltRPMIndex._findRPMFile(rpmPkg, version, release,
+                                                 SPECS.getData().getBuildArch(rpmPkg, version))
+            if rpmFile is not None:
+                mapRPMPackageToFile[rpmPkg] = rpmFile
+
+        debugrpmFile = BuiltRPMIndex._findRPMFile(package + "-debuginfo", version, release,
+                                                  SPECS.getData().getBuildArch(package, version))
+
+        srpmFile = None
+        srpmFiles = RPMIndex.findFile(constants.sourceRpmPath,
+                                      package + "-" + version + "-" + release + ".src.rpm")
+        if len(srpmFiles) == 1:
+            srpmFile = srpmFiles[0]
+        return mapRPMPackageToFile, srpmFile, debugrpmFile
+
+    # Adds the files of a package which was just built to RPMIndex. A
+    # lookup which misses rescans only directories whose mtime changed,
+    # which misses files written in the same mtime tick as the last scan.
+    @staticmethod
+    def addBuiltFiles(package, version):
+        release = SPECS.getData().getRelease(package, version)
+        listRPMFiles = [BuiltRPMIndex._getRPMFile(rpmPkg, version, release,
+                                                  SPECS.getData().getBuildArch(rpmPkg, version))
+                        for rpmPkg in SPECS.getData().getRPMPackages(package, version)]
+        listRPMFiles.append(BuiltRPMIndex._getRPMFile(package + "-debuginfo", version, release,
+                                                      SPECS.getData().getBuildArch(package,
+                                                                                   version)))
+        RPMIndex.addFiles(constants.rpmPath, [f for f in listRPMFiles if os.path.isfile(f)])
+        srpmFile = (constants.sourceRpmPath + "/" + package + "-" + version + "-" + release +
+                    ".src.rpm")
+        if os.path.isfile(srpmFile):
+            RPMIndex.addFiles(constants.sourceRpmPath, [srpmFile])
+
+    # Returns (RPM files, SRPM files) of a package
+    @staticmethod
+    def getPackageFiles(package, version):
+        mapRPMPackageToFile, srpmFile, debugrpmFile = BuiltRPMIndex.findPackageFiles(package,
+                                                                                     version)
+        listRPMFiles = list(mapRPMPackageToFile.values())
+        if debugrpmFile is not None:
+            listRPMFiles.append(debugrpmFile)
+        listSRPMFiles = []
+        if srpmFile is not None:
+            listSRPMFiles.append(srpmFile)
+        return listRPMFiles, listSRPMFiles
+
+    # Reads the headers of the RPM files of a package, replacing the
+    # entries of an earlier build
+    @staticmethod
+    def addPackage(package, version):
+        listRPMFiles, listSRPMFiles = BuiltRPMIndex.getPackageFiles(package, version)
+        entries = [BuiltRPMIndex._readEntry(f) for f in listRPMFiles + listSRPMFiles]
+        with BuiltRPMIndex.lock:
+            BuiltRPMIndex._removePackage(package + "-" + version)
+            BuiltRPMIndex.mapPackageToEntries[package + "-" + version] = entries
+            for entry in entries:
+                BuiltRPMIndex.mapPathToEntry[entry["path"]] = entry
+                if entry["arch"] == "src":
+                    continue
+                for name, _, _ in entry["provides"]:
+                    BuiltRPMIndex.mapProvideToPaths.setdefault(name, set()).add(entry["path"])
+        return entries
+
+    # Returns the entries of the RPM files of a package
+    @staticmethod
+    def getPackage(package, version):
+        with BuiltRPMIndex.lock:
+            entries = BuiltRPMIndex.mapPackageToEntries.get(package + "-" + version)
+        if entries is None:
+            entries = BuiltRPMIndex.addPackage(package, version)
+        return entries
+
+    @staticmethod
+    def getEntry(rpmFile):
+        with BuiltRPMIndex.lock:
+            return BuiltRPMIndex.mapPathToEntry.get(rpmFile)
+
+    # Returns the entries of the indexed RPMs providing a capability
+    @staticmethod
+    def whatProvides(capability):
+        with BuiltRPMIndex.lock:
+            return [BuiltRPMIndex.mapPathToEntry[path]
+                    for path in sorted(BuiltRPMIndex.mapProvideToPaths.get(capability, []))]
+
+    @staticmethod
+    def clear():
+        with BuiltRPMIndex.lock:
+            BuiltRPMIndex.mapPackageToEntries = {}
+            BuiltRPMIndex.mapPathToEntry = {}
+            BuiltRPMIndex.mapProvideToPaths = {}
+
+    # Must be called with BuiltRPMIndex.lock held
+    @staticmethod
+    def _removePackage(pkg):
+        for entry in BuiltRPMIndex.mapPackageToEntries.pop(pkg, []):
+            BuiltRPMIndex.mapPathToEntry.pop(entry["path"], None)
+            for name, _, _ in entry["provides"]:
+                BuiltRPMIndex.mapProvideToPaths.get(name, set()).discard(entry["path"])
+
+    @staticmethod
+    def _getRPMFile(rpmPkg, version, release, arch):
+        return (constants.rpmPath + "/" + arch + "/" + rpmPkg + "-" + version + "-" +
+                release + "." + arch + ".rpm")
+
+    @staticmethod
+    def _findRPMFile(rpmPkg, version, release, arch):
+        rpmFile = BuiltRPMIndex._getRPMFile(rpmPkg, version, release, arch)
+        if RPMIndex.isFile(constants.rpmPath, rpmFile):
+            return rpmFile
+        return None
+
+    @staticmethod
+    def _readEntry(rpmFile):
+        header = RPMHeader(rpmFile)
+        sha256 = hashlib.sha256()
+        with open(rpmFile, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return {"path": rpmFile,
+                "name": header.getName(),
+                "epoch": header.getEpoch(),
+                "version": header.getVersion(),
+                "release": header.getRelease(),
+                "arch": header.getArch(),
+                "sourcerpm": header.get(RPMHeader.tagSourceRPM),
+                "provides": header.getProvides(),
+                "requires": header.getRequires(),
+                "conflicts": header.getConflicts(),
+                "obsoletes": header.getObsoletes(),
+                "installedSize": (header.get(RPMHeader.tagLongSize) or
+                                  header.get(RPMHeader.tagSize, [0]))[0],
+                "payloadSize": header.getPayloadSize(),
+                "size": os.path.getsize(rpmFile),
+                "sha256": sha256.hexdigest(),
+                "headerRange": (header.headerStart, header.headerEnd)}
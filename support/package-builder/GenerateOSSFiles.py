@@ -35,6 +35,8 @@ def main():
                         default=False, action="store_true")
     parser.add_argument("-d",  "--dist-tag", dest="dist",
                         default="")
+    parser.add_argument("-sc", "--spec-cache-path", dest="specCachePath",
+                        default="../../stage/spec-cache")
 
     options = parser.parse_args()
     errorFlag = False
@@ -82,6 +84,7 @@ def main():
         constants.setLogPath(options.logPath)
         constants.setLogLevel(options.logLevel)
         constants.setPullSourcesURL(get_baseurl(options.pullsourcesConfig))
+        constants.setSpecCachePath(options.specCachePath)
         constants.initialize()
 
         # parse SPECS folder
@@ -0,0 +1,81 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Computes the RPM files to install into a sandbox before building a
+# package in one walk over the runtime dependencies, instead of looking
+# up RPM files and installed packages again for every path to a
+# dependency. The walk does not go through members of dependency cycles,
+# which may not be built yet, like the recursive install did. The plan is
+# split in the RPMs installed with --nodeps and the others, each
+# installed in a single rpm transaction, and sorted so that the same
+# inputs always give the same plan and the same plan key.
+
+import hashlib
+import json
+from SpecData import SPECS
+from StringUtils import StringUtils
+from constants import constants
+
+class InstallPlan(object):
+
+    def __init__(self, rpmFiles, noDepsRPMFiles):
+        # sorted lists of (package, RPM file)
+        self.rpmFiles = rpmFiles
+        self.noDepsRPMFiles = noDepsRPMFiles
+
+    def isEmpty(self):
+        return not self.rpmFiles and not self.noDepsRPMFiles
+
+    # Host paths of all RPM files of the plan
+    def getRPMFiles(self):
+        return [rpmFile for _, rpmFile in self.noDepsRPMFiles + self.rpmFiles]
+
+    def serialize(self):
+        return json.dumps({"rpms": self.rpmFiles, "nodeps": self.noDepsRPMFiles},
+                          sort_keys=True, separators=(",", ":"))
+
+    def getKey(self):
+        return hashlib.sha1(self.serialize().encode()).hexdigest()
+
+
+class InstallPlanner(object):
+
+    def __init__(self, logger, mapPackageToCycles, listNodepsPackages):
+        self.logger = logger
+        self.mapPackageToCycles = mapPackageToCycles
+        self.listNodepsPackages = listNodepsPackages
+
+    # listPackages are the name-version of the packages to install with
+    # their runtime dependencies, listInstalledPackages the name-version of
+    # the packages installed already. findRPMFile returns the RPM file of
+    # a package and version. mapPackageToCycles is keyed by name-version.
+    def getPlan(self, listPackages, listInstalledPackages, findRPMFile):
+        installedPackages = set(listInstalledPackages)
+        packagesToInstall = set()
+        # the runtime dependencies of installed packages are installed too
+        pkgsToVisit = sorted(set(listPackages) - installedPackages)
+        while pkgsToVisit:
+            pkg = pkgsToVisit.pop()
+            if pkg in packagesToInstall:
+                continue
+            packagesToInstall.add(pkg)
+            for depPkg in SPECS.getData().getRequiresForPkg(pkg):
+                if (depPkg not in self.mapPackageToCycles and
+                        depPkg not in installedPackages and
+                        depPkg not in packagesToInstall):
+                    pkgsToVisit.append(depPkg)
+
+        rpmFiles = []
+        noDepsRPMFiles = []
+        for pkg in sorted(packagesToInstall):
+            package, version = StringUtils.splitPackageNameAndVersion(pkg)
+            rpmFile = findRPMFile(package, version)
+            if rpmFile is None:
+                self.logger.error("No rpm file found for package: " + pkg)
+                raise Exception("Missing rpm file")
+            if (pkg in self.mapPackageToCycles or
+                    package in self.listNodepsPackages or
+                    package in constants.noDepsPackageList):
+                noDepsRPMFiles.append((package, rpmFile))
+            else:
+                rpmFiles.append((package, rpmFile))
+        return InstallPlan(rpmFiles, noDepsRPMFiles)
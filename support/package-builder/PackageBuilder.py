@@ -1,13 +1,17 @@
 import sys
 import os.path
+import time
 from PackageUtils import PackageUtils
+from InstallPlanner import InstallPlanner
 from Logger import Logger
 from ToolChainUtils import ToolChainUtils
 from CommandUtils import CommandUtils
 from constants import constants
 from SpecData import SPECS
 from StringUtils import StringUtils
-from Sandbox import Chroot, Container
+from SandboxPool import SandboxPool
+from BuildHistory import BuildHistory
+from BuildTrace import BuildTrace
 
 class PackageBuilder(object):
     def __init__(self, mapPackageToCycles, sandboxType):
@@ -20,6 +24,8 @@ class PackageBuilder(object):
         self.doneList = None
         self.sandboxType = sandboxType
         self.sandbox = None
+        # whether the sandbox came created from the SandboxPool
+        self.sandboxCreated = False
         self.mapPackageToCycles = mapPackageToCycles
         self.listNodepsPackages = ["glibc", "gmp", "zlib", "file", "binutils", "mpfr",
                                    "mpc", "gcc", "ncurses", "util-linux", "groff", "perl",
@@ -37,48 +43,41 @@ class PackageBuilder(object):
 
         self._buildPackagePrepareFunction(packageName, packageVersion, doneList)
         try:
-            self._buildPackage()
+            with BuildTrace.span(pkg, category="package"):
+                self._buildPackage()
         except Exception as e:
             # TODO: self.logger might be None
             self.logger.exception(e)
             raise e
 
     def _buildPackage(self):
+        # wall-clock duration of every build phase, in seconds
+        phases = {}
         try:
-            self.sandbox.create(self.package + "-" + self.version)
+            phaseStartTime = time.time()
+            with BuildTrace.span("chroot create"):
+                if not self.sandboxCreated:
+                    self.sandbox.create(self.package + "-" + self.version)
 
             tUtils = ToolChainUtils(self.logName, self.logPath)
-            if self.sandbox.hasToolchain():
-                tUtils.installExtraToolchainRPMS(self.sandbox, self.package, self.version)
-            else:
-                tUtils.installToolchainRPMS(self.sandbox, self.package, self.version, availablePackages=self.doneList)
-
-            listDependentPackages, listTestPackages, listInstalledPackages, listInstalledRPMs = (
-                self._findDependentPackagesAndInstalledRPM(self.sandbox))
-
-            pkgUtils = PackageUtils(self.logName, self.logPath)
-
-            if listDependentPackages:
-                self.logger.debug("Installing the build time dependent packages......")
-                for pkg in listDependentPackages:
-                    packageName, packageVersion = StringUtils.splitPackageNameAndVersion(pkg)
-                    self._installPackage(pkgUtils, packageName, packageVersion, self.sandbox, self.logPath,listInstalledPackages, listInstalledRPMs)
-                for pkg in listTestPackages:
-                    flag = False
-                    packageName, packageVersion = StringUtils.splitPackageNameAndVersion(pkg)
-                    for depPkg in listDependentPackages:
-                        depPackageName, depPackageVersion = StringUtils.splitPackageNameAndVersion(depPkg)
-                        if depPackageName == packageName:
-                            flag = True
-                            break;
-                    if flag == False:
-                        self._installPackage(pkgUtils, packageName,packageVersion, self.sandbox, self.logPath,listInstalledPackages, listInstalledRPMs)
-                pkgUtils.installRPMSInOneShot(self.sandbox)
-                self.logger.debug("Finished installing the build time dependent packages....")
-
-            pkgUtils.adjustGCCSpecs(self.sandbox, self.package, self.version)
+            with BuildTrace.span("installToolchainRPMS"):
+                if self.sandbox.hasToolchain():
+                    tUtils.installExtraToolchainRPMS(self.sandbox, self.package, self.version)
+                else:
+                    tUtils.installToolchainRPMS(self.sandbox, self.package, self.version, availablePackages=self.doneList)
+            phases["sandbox"] = time.time() - phaseStartTime
+
+            phaseStartTime = time.time()
+            with BuildTrace.span("dependency install"):
+                pkgUtils = self._installDependentPackages()
+            phases["dependencies"] = time.time() - phaseStartTime
+
+            phaseStartTime = time.time()
+            with BuildTrace.span("adjustGCCSpecs"):
+                pkgUtils.adjustGCCSpecs(self.sandbox, self.package, self.version)
             pkgUtils.buildRPMSForGivenPackage(self.sandbox, self.package, self.version,
                                               self.logPath)
+            phases["rpmbuild"] = time.time() - phaseStartTime
             self.logger.debug("Successfully built the package: " + self.package)
         except Exception as e:
             self.logger.error("Failed while building package: " + self.package)
@@ -89,7 +88,40 @@ class PackageBuilder(object):
             self.logger.info(fileLog)
             raise e
         if self.sandbox:
-            self.sandbox.destroy()
+            phaseStartTime = time.time()
+            with BuildTrace.span("destroy"):
+                SandboxPool.releaseSandbox(self.sandbox)
+            phases["destroy"] = time.time() - phaseStartTime
+        # make check durations are not build durations
+        if not constants.rpmCheck:
+            BuildHistory.recordBuild(self.package, self.version, phases)
+
+    # Returns PackageUtils holding the install transaction
+    def _installDependentPackages(self):
+        listDependentPackages, listTestPackages, listInstalledPackages, listInstalledRPMs = (
+            self._findDependentPackagesAndInstalledRPM(self.sandbox))
+
+        pkgUtils = PackageUtils(self.logName, self.logPath)
+
+        if listDependentPackages:
+            self.logger.debug("Installing the build time dependent packages......")
+            listPackages = list(listDependentPackages)
+            # test packages are installed unless another version of them is
+            # a build dependency
+            dependentPackageNames = set(StringUtils.splitPackageNameAndVersion(pkg)[0]
+                                        for pkg in listDependentPackages)
+            listPackages.extend(pkg for pkg in listTestPackages
+                                if (StringUtils.splitPackageNameAndVersion(pkg)[0] not in
+                                    dependentPackageNames))
+            planner = InstallPlanner(self.logger, self.mapPackageToCycles,
+                                     self.listNodepsPackages)
+            installPlan = planner.getPlan(listPackages, listInstalledPackages,
+                                          pkgUtils.findRPMFile)
+            self.logger.debug("Install plan " + installPlan.getKey() + ": " +
+                              installPlan.serialize())
+            pkgUtils.installPlan(self.sandbox, installPlan)
+            self.logger.debug("Finished installing the build time dependent packages....")
+        return pkgUtils
 
     def _buildPackagePrepareFunction(self, package, version, doneList):
         self.package = package
@@ -102,14 +134,8 @@ class PackageBuilder(object):
         self.logger = Logger.getLogger(self.logName, self.logPath, constants.logLevel)
         self.doneList = doneList
 
-        if self.sandboxType == "chroot":
-            sandbox = Chroot(self.logger)
-        elif self.sandboxType == "container":
-            sandbox = Container(self.logger)
-        else:
-            raise Exception("Unknown sandbox type: " + sandboxType)
-
-        self.sandbox = sandbox
+        self.sandbox, self.sandboxCreated = SandboxPool.getSandbox(self.sandboxType,
+                                                                   self.logger)
 
     def _findPackageNameAndVersionFromRPMFile(self, rpmfile):
         rpmfile = os.path.basename(rpmfile)
@@ -135,58 +161,16 @@ class PackageBuilder(object):
         return basePkg in doneList
 
 
-    def _findRunTimeRequiredRPMPackages(self, rpmPackage, version):
-        return SPECS.getData().getRequiresForPackage(rpmPackage, version)
-
     def _findBuildTimeRequiredPackages(self):
         return SPECS.getData().getBuildRequiresForPackage(self.package, self.version)
 
     def _findBuildTimeCheckRequiredPackages(self):
         return SPECS.getData().getCheckBuildRequiresForPackage(self.package, self.version)
 
-    def _installPackage(self, pkgUtils, package, packageVersion, sandbox, destLogPath,
-                        listInstalledPackages, listInstalledRPMs):
-        rpmfile = pkgUtils.findRPMFile(package,packageVersion);
-        if rpmfile is None:
-            self.logger.error("No rpm file found for package: " + package + "-" + packageVersion)
-            raise Exception("Missing rpm file")
-        specificRPM = os.path.basename(rpmfile.replace(".rpm", ""))
-        pkg = package+"-"+packageVersion
-        if pkg in listInstalledPackages:
-                return
-        # mark it as installed -  to avoid cyclic recursion
-        listInstalledPackages.append(pkg)
-        listInstalledRPMs.append(specificRPM)
-        self._installDependentRunTimePackages(pkgUtils, package, packageVersion, sandbox, destLogPath,
-                                              listInstalledPackages, listInstalledRPMs)
-        noDeps = False
-        if (package in self.mapPackageToCycles or
-                package in self.listNodepsPackages or
-                package in constants.noDepsPackageList):
-            noDeps = True
-        pkgUtils.prepRPMforInstall(package,packageVersion, noDeps, destLogPath)
-
-    def _installDependentRunTimePackages(self, pkgUtils, package, packageVersion, sandbox, destLogPath,
-                                         listInstalledPackages, listInstalledRPMs):
-        listRunTimeDependentPackages = self._findRunTimeRequiredRPMPackages(package, packageVersion)
-        if listRunTimeDependentPackages:
-            for pkg in listRunTimeDependentPackages:
-                if pkg in self.mapPackageToCycles:
-                    continue
-                packageName, packageVersion = StringUtils.splitPackageNameAndVersion(pkg)
-                rpmfile = pkgUtils.findRPMFile(packageName, packageVersion)
-                if rpmfile is None:
-                    self.logger.error("No rpm file found for package: " + packageName + "-" + packageVersion)
-                    raise Exception("Missing rpm file")
-                latestPkgRPM = os.path.basename(rpmfile).replace(".rpm", "")
-                if pkg in listInstalledPackages and latestPkgRPM in listInstalledRPMs:
-                    continue
-                self._installPackage(pkgUtils, packageName,packageVersion, sandbox, destLogPath,listInstalledPackages, listInstalledRPMs)
-
     def _findDependentPackagesAndInstalledRPM(self, sandbox):
         listInstalledPackages, listInstalledRPMs = self._findInstalledPackages(sandbox)
         self.logger.debug(listInstalledPackages)
-        listDependentPackages = self._findBuildTimeRequiredPackages()
+        listDependentPackages = list(self._findBuildTimeRequiredPackages())
         listTestPackages=[]
         if constants.rpmCheck and self.package in constants.testForceRPMS:
             # One time optimization
@@ -5,6 +5,7 @@ from constants import constants
 from CommandUtils import CommandUtils
 from PackageUtils import PackageUtils
 from SpecData import SPECS
+from BuiltRPMIndex import BuiltRPMIndex
 
 class PackageInfo(object):
 
@@ -21,24 +22,17 @@ class PackageInfo(object):
     def loadPackagesData(self):
         listPackages = SPECS.getData().getListPackages()
         listPackages.sort()
-        cmdUtils = CommandUtils()
         for package in listPackages:
             for version in SPECS.getData().getVersions(package):
-                release = SPECS.getData().getRelease(package, version)
                 listRPMPackages = SPECS.getData().getRPMPackages(package, version)
-                srpmFileName = package + "-" + version + "-" + release + ".src.rpm"
-                srpmFiles = cmdUtils.findFile(srpmFileName, constants.sourceRpmPath)
-                srpmFile = None
-                if len(srpmFiles) == 1:
-                    srpmFile = srpmFiles[0]
-                debugrpmFileName = package + "-debuginfo-" + version + "-" + release + "*"
-                debugrpmFiles = cmdUtils.findFile(debugrpmFileName, constants.rpmPath)
-                debugrpmFile = None
-                if len(debugrpmFiles) == 1:
-                    debugrpmFile = debugrpmFiles[0]
+                mapRPMPackageToFile, srpmFile, debugrpmFile = \
+                    BuiltRPMIndex.findPackageFiles(package, version)
                 pkgUtils = PackageUtils(self.logName, self.logPath)
                 for rpmPkg in listRPMPackages:
-                    rpmFile = pkgUtils.findRPMFile(rpmPkg, version)
+                    rpmFile = mapRPMPackageToFile.get(rpmPkg)
+                    if rpmFile is None:
+                        # input RPMs
+                        rpmFile = pkgUtils.findRPMFile(rpmPkg, version)
                     if rpmFile is not None:
                         listPkgAttributes = {"sourcerpm":srpmFile, "rpm":rpmFile,
                                              "debugrpm":debugrpmFile}
@@ -1,15 +1,19 @@
 import os
 import threading
 import copy
+import json
 from PackageBuildDataGenerator import PackageBuildDataGenerator
 from Logger import Logger
 from constants import constants
-import docker
 from CommandUtils import CommandUtils
 from PackageUtils import PackageUtils
 from ToolChainUtils import ToolChainUtils
 from Scheduler import Scheduler
 from ThreadPool import ThreadPool
+from SandboxPool import SandboxPool
+from RepoData import RepoData
+import PullSources
+from SourceCache import SourceCache
 from SpecData import SPECS
 from StringUtils import StringUtils
 from Sandbox import Chroot, Container
@@ -31,7 +35,7 @@ class PackageManager(object):
         self.listOfPackagesAlreadyBuilt = set()
         self.pkgBuildType = pkgBuildType
         if self.pkgBuildType == "container":
-            self.dockerClient = docker.from_env(version="auto")
+            self.dockerClient = Container.getDockerClient()
 
     def buildToolChain(self):
         pkgCount = 0
@@ -143,6 +147,32 @@ class PackageManager(object):
 
         return True
 
+    # Downloads the missing sources of the packages to build, so that
+    # builds don't wait for downloads
+    def _prefetchSources(self):
+        if constants.prefetchThreads <= 0:
+            return
+        listSources = []
+        fetchedSources = set()
+        for pkg in self.sortedPackageList:
+            if pkg in self.listOfPackagesAlreadyBuilt and not constants.rpmCheck:
+                continue
+            package, version = StringUtils.splitPackageNameAndVersion(pkg)
+            URLs = constants.getPullSourcesURLs(package)
+            for source in (SPECS.getData().getSources(package, version) +
+                           SPECS.getData().getPatches(package, version)):
+                sha1 = SPECS.getData().getSHA1(package, version, source)
+                # sources without sha1 are next to the spec
+                if sha1 is None or (source, sha1) in fetchedSources:
+                    continue
+                fetchedSources.add((source, sha1))
+                listSources.append((package, source, sha1, URLs))
+        if not listSources:
+            return
+        self.logger.info("Prefetching " + str(len(listSources)) + " source(s)")
+        PullSources.prefetch(listSources, SourceCache.fetch, constants.prefetchThreads,
+                             self.logger)
+
     def _buildTestPackages(self, buildThreads):
         self.buildToolChain()
         self._buildGivenPackages(constants.listMakeCheckRPMPkgtoInstall, buildThreads)
@@ -173,19 +203,31 @@ class PackageManager(object):
             self.logger.error("Unable to set parameters. Terminating the package manager.")
             raise Exception("Unable to set parameters")
 
+        self._prefetchSources()
+
+        listOfPackagesBuiltBefore = set(self.listOfPackagesAlreadyBuilt)
         statusEvent = threading.Event()
         self._initializeScheduler(statusEvent)
         self._initializeThreadPool(statusEvent)
 
-        for i in range(0, buildThreads):
-            workerName = "WorkerThread" + str(i)
-            ThreadPool.addWorkerThread(workerName)
-            ThreadPool.startWorkerThread(workerName)
+        # forks the worker processes, before any other thread is started
+        ThreadPool.addWorkerThreads(buildThreads)
+        if constants.generateRepoData:
+            RepoData.start(constants.rpmPath, self.logger)
+        # Worker processes set up their sandboxes themselves
+        if constants.workerType == "thread":
+            SandboxPool.start(self.pkgBuildType, buildThreads, self.logger)
+        ThreadPool.startWorkerThreads()
 
         statusEvent.wait()
-        Scheduler.stopScheduling = True
+        Scheduler.stop()
         self.logger.debug("Waiting for all remaining worker threads")
         ThreadPool.join_all()
+        ThreadPool.logWorkerStats()
+        SandboxPool.stop()
+        RepoData.stop()
+        # the build container image changes between builds
+        Container.removeIdleContainers()
 
         setFailFlag = False
         allPackagesBuilt = False
@@ -195,6 +237,8 @@ class PackageManager(object):
         if Scheduler.isAllPackagesBuilt():
             allPackagesBuilt = True
 
+        self._writeBuildReport(listOfPackagesBuiltBefore)
+
         if setFailFlag:
             self.logger.error("Some of the packages failed:")
             self.logger.error(Scheduler.listOfFailedPackages)
@@ -207,6 +251,21 @@ class PackageManager(object):
                 self.logger.error("Build stopped unexpectedly.Unknown error.")
                 raise Exception("Unknown error")
 
+    def _writeBuildReport(self, listOfPackagesBuiltBefore):
+        report = {
+            "built": sorted(set(Scheduler.getDoneList()) - listOfPackagesBuiltBefore),
+            "failed": sorted(Scheduler.listOfFailedPackages),
+            "skipped": sorted(Scheduler.getSkippedList()),
+        }
+        self.logger.info("Build report:")
+        for status in ["built", "failed", "skipped"]:
+            self.logger.info("%-8s %d package(s)" % (status + ":", len(report[status])))
+        if report["skipped"]:
+            self.logger.error("Packages skipped because of failed packages:")
+            self.logger.error(report["skipped"])
+        with open(os.path.join(self.logPath, "BuildReport.json"), 'w') as reportFile:
+            reportFile.write(json.dumps(report, sort_keys=True, indent=4))
+
     def _createBuildContainer(self, usePublishedRPMs):
         self.logger.debug("Generating photon build container..")
         try:
@@ -1,14 +1,16 @@
 import os
 import platform
 import shutil
-import re
 import random
 import string
 from CommandUtils import CommandUtils
 from Logger import Logger
 from constants import constants
-import PullSources
 from SpecData import SPECS
+from BuildTrace import BuildTrace
+from RPMIndex import RPMIndex
+from BuiltRPMIndex import BuiltRPMIndex
+from SourceCache import SourceCache
 from distutils.version import LooseVersion
 
 class PackageUtils(object):
@@ -33,18 +35,10 @@ class PackageUtils(object):
         self.forceRpmPackageOptions = "--force"
         self.replaceRpmPackageOptions = "--replacepkgs"
         self.adjustGCCSpecScript = "adjust-gcc-specs.sh"
-        self.rpmFilesToInstallInAOneShot = ""
-        self.packagesToInstallInAOneShot = ""
-        self.noDepsRPMFilesToInstallInAOneShot = ""
-        self.noDepsPackagesToInstallInAOneShot = ""
         self.logfnvalue = None
 
-    def prepRPMforInstall(self, package, version, noDeps=False, destLogPath=None):
-        rpmfile = self.findRPMFile(package, version)
-        if rpmfile is None:
-            self.logger.error("No rpm file found for package: " + package)
-            raise Exception("Missing rpm file")
-
+    # Path of an RPM file of the host in the sandbox
+    def _getSandboxRPMPath(self, rpmfile):
         rpmName = os.path.basename(rpmfile)
         #TODO: path from constants
         if "PUBLISHRPMS" in rpmfile:
@@ -60,31 +54,33 @@ class PackageUtils(object):
             rpmDestFile += "noarch/"
         else:
             rpmDestFile += platform.machine()+"/"
-        rpmDestFile += rpmName
+        return rpmDestFile + rpmName
 
-        if noDeps:
-            self.noDepsRPMFilesToInstallInAOneShot += " " + rpmDestFile
-            self.noDepsPackagesToInstallInAOneShot += " " + package
-        else:
-            self.rpmFilesToInstallInAOneShot += " " + rpmDestFile
-            self.packagesToInstallInAOneShot += " " + package
+    # Installs the RPMs of an InstallPlan
+    def installPlan(self, sandbox, installPlan):
+        sandbox.installPackages(installPlan.getRPMFiles(),
+                                lambda: self._installPlan(sandbox, installPlan))
 
-    def installRPMSInOneShot(self, sandbox):
+    def _installPlan(self, sandbox, installPlan):
         rpmInstallcmd = self.rpmBinary + " " + self.installRPMPackageOptions
         # TODO: Container sandbox might need  + self.forceRpmPackageOptions
-        if self.noDepsRPMFilesToInstallInAOneShot != "":
+        if installPlan.noDepsRPMFiles:
             self.logger.debug("Installing nodeps rpms: " +
-                             self.noDepsPackagesToInstallInAOneShot)
-            cmd = (rpmInstallcmd+" "+self.nodepsRPMPackageOptions + " " +
-                   self.noDepsRPMFilesToInstallInAOneShot)
+                              " ".join(package for package, _ in installPlan.noDepsRPMFiles))
+            cmd = (rpmInstallcmd + " " + self.nodepsRPMPackageOptions + " " +
+                   " ".join(self._getSandboxRPMPath(rpmFile)
+                            for _, rpmFile in installPlan.noDepsRPMFiles))
             returnVal = sandbox.run(cmd, logfn=self.logger.debug)
             if returnVal != 0:
                 self.logger.debug("Command Executed:" + cmd)
                 self.logger.error("Unable to install rpms. Error {}".format(returnVal))
                 raise Exception("RPM installation failed")
-        if self.rpmFilesToInstallInAOneShot != "":
-            self.logger.debug("Installing rpms: " + self.packagesToInstallInAOneShot)
-            cmd = rpmInstallcmd+" "+self.rpmFilesToInstallInAOneShot
+        if installPlan.rpmFiles:
+            self.logger.debug("Installing rpms: " +
+                              " ".join(package for package, _ in installPlan.rpmFiles))
+            cmd = (rpmInstallcmd + " " +
+                   " ".join(self._getSandboxRPMPath(rpmFile)
+                            for _, rpmFile in installPlan.rpmFiles))
             returnVal = sandbox.run(cmd, logfn=self.logger.debug)
             if returnVal != 0:
                 self.logger.debug("Command Executed:" + cmd)
@@ -113,8 +109,9 @@ class PackageUtils(object):
         self.logger.debug("Extra source URLs for " + package + ": " + str(sources_urls))
         constants.setExtraSourcesURLs(package, sources_urls)
 
-        self._copySources(sandbox, listSourcesFiles, package, version, sourcePath)
-        self._copySources(sandbox, listPatchFiles, package, version, sourcePath)
+        with BuildTrace.span("source copy"):
+            self._copySources(sandbox, listSourcesFiles + listPatchFiles, package, version,
+                              sourcePath)
 
         #Adding rpm macros
         listRPMMacros = constants.userDefinedMacros
@@ -124,8 +121,9 @@ class PackageUtils(object):
         listRPMFiles = []
         listSRPMFiles = []
         try:
-            listRPMFiles, listSRPMFiles = self._buildRPM(sandbox, specPath + specName,
-                                                         logFilePath, package, version, macros)
+            with BuildTrace.span("rpmbuild"):
+                listRPMFiles, listSRPMFiles = self._buildRPM(sandbox, specPath + specName,
+                                                             logFilePath, package, version, macros)
             logmsg = package + " build done - RPMs : [ "
             for f in listRPMFiles:
                 logmsg += (os.path.basename(f) + " ")
@@ -151,13 +149,13 @@ class PackageUtils(object):
         filename= package + "-" + version + "-" + release + "." + buildarch+".rpm"
 
         fullpath = constants.rpmPath + "/" + buildarch + "/" + filename
-        if os.path.isfile(fullpath):
+        if RPMIndex.isFile(constants.rpmPath, fullpath):
             return fullpath
 
         if constants.inputRPMSPath is not None:
             fullpath = constants.inputRPMSPath + "/" + buildarch + "/" + filename
-        if os.path.isfile(fullpath):
-            return fullpath
+            if RPMIndex.isFile(constants.inputRPMSPath, fullpath):
+                return fullpath
 
         return None
 
@@ -193,8 +191,10 @@ class PackageUtils(object):
         # Fetch/verify sources if sha1 not None.
         sha1 = SPECS.getData().getSHA1(package, version, source)
         if sha1 is not None:
-            PullSources.get(package, source, sha1, constants.sourcePath,
-                            constants.getPullSourcesURLs(package), self.logger)
+            sourcePath = SourceCache.fetch(package, source, sha1,
+                                           constants.getPullSourcesURLs(package), self.logger)
+            if sourcePath is not None:
+                return [sourcePath]
 
         sourcePath = cmdUtils.findFile(source, constants.sourcePath)
         if not sourcePath:
@@ -219,18 +219,19 @@ class PackageUtils(object):
 
     def _copySources(self, sandbox, listSourceFiles, package, version, destDir):
         # Fetch and verify sha1 if missing
+        listSourcePaths = []
         for source in listSourceFiles:
             sourcePath = self._verifyShaAndGetSourcePath(source, package, version)
             self.logger.debug("Copying... Source path :" + source +
                              " Source filename: " + sourcePath[0])
-            sandbox.put(sourcePath[0], destDir)
+            listSourcePaths.append(sourcePath[0])
+        sandbox.putFiles(listSourcePaths, destDir)
 
     def _getAdditionalBuildOptions(self, package):
-        pullsources_urls = []
+        pullsources_urls = constants.getAdditionalSourcesURLs(package)
         macros = []
         if package in constants.buildOptions.keys():
             pkg = constants.buildOptions[package]
-            pullsources_urls.extend(pkg["pullsources"])
             macros.extend(pkg["macros"])
         return pullsources_urls, macros
 
@@ -282,22 +283,9 @@ class PackageUtils(object):
                 self.logger.error("Building rpm is failed " + specFile)
                 raise Exception("RPM build failed")
 
-        #Extracting rpms created from log file
-        listRPMFiles = []
-        listSRPMFiles = []
-        stageLogFile = logFile.replace(constants.topDirPath + "/LOGS", constants.logPath )
-        with open(stageLogFile, 'r') as logfile:
-            fileContents = logfile.readlines()
-            for i in range(0, len(fileContents)):
-                if re.search("^Wrote:", fileContents[i]):
-                    listcontents = fileContents[i].split()
-                    if ((len(listcontents) == 2) and
-                            listcontents[1].strip().endswith(".rpm") and
-                            "/RPMS/" in listcontents[1]):
-                        listRPMFiles.append(listcontents[1])
-                    if ((len(listcontents) == 2) and
-                            listcontents[1].strip().endswith(".src.rpm") and
-                            "/SRPMS/" in listcontents[1]):
-                        listSRPMFiles.append(listcontents[1])
-        return listRPMFiles, listSRPMFiles
+        # rpmbuild does not write RPMs when only checking
+        if constants.rpmCheck and package in constants.testForceRPMS:
+            return [], []
+        BuiltRPMIndex.addBuiltFiles(package, version)
+        return BuiltRPMIndex.getPackageFiles(package, version)
 
@@ -11,18 +11,72 @@ import hashlib
 import requests
 import string
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from CommandUtils import CommandUtils
 
+# HTTP session shared by all downloads, keeping connections to the
+# source servers open
+session = None
+# map destination file to the lock serializing its fetches
+fileLocks = {}
+lock = threading.Lock()
+
 def getFileHash(filepath):
     sha1 = hashlib.sha1()
-    f = open(filepath, 'rb')
-    try:
-        sha1.update(f.read())
-    finally:
-        f.close()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha1.update(block)
     return sha1.hexdigest()
 
+def getSession(poolSize=10):
+    global session
+    with lock:
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize,
+                                                    pool_maxsize=poolSize)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+# Drops the session of the parent in a forked process, whose connections
+# must not be shared
+def clearSession():
+    global session
+    session = None
+
+def _getFileLock(destfile):
+    with lock:
+        if destfile not in fileLocks:
+            fileLocks[destfile] = threading.Lock()
+        return fileLocks[destfile]
+
 def get(package, source, sha1, sourcesPath, URLs, logger):
+    # a concurrent fetch of the same file is waited for, and then finds it
+    with _getFileLock(os.path.join(sourcesPath, source)):
+        _get(package, source, sha1, sourcesPath, URLs, logger)
+
+# Fetches and verifies sources concurrently. listSources is a list of
+# (package, source, sha1, URLs), fetchFn(package, source, sha1, URLs,
+# logger) fetches one of them. Returns the sources which failed.
+def prefetch(listSources, fetchFn, numThreads, logger):
+    getSession(numThreads)
+    def fetch(packageSource):
+        package, source, sha1, URLs = packageSource
+        try:
+            fetchFn(package, source, sha1, URLs, logger)
+        except Exception as e:
+            # fetched again, and reported if it fails, at build time
+            logger.info("Unable to prefetch source " + source + " of " + package + ": " +
+                        str(e))
+            return source
+        return None
+    with ThreadPoolExecutor(max_workers=numThreads) as executor:
+        return [source for source in executor.map(fetch, listSources)
+                if source is not None]
+
+def _get(package, source, sha1, sourcesPath, URLs, logger):
     cmdUtils = CommandUtils()
     sourcePath = cmdUtils.findFile(source, sourcesPath)
     if sourcePath is not None and len(sourcePath) > 0:
@@ -43,7 +97,7 @@ def get(package, source, sha1, sourcesPath, URLs, logger):
         try:
             downloadFile(url, destfile)
             if sha1 != getFileHash(destfile):
-                raise Exception('Invalid sha1 for package %s file %s' % package, source)
+                raise Exception('Invalid sha1 for package %s file %s' % (package, source))
             return
         except requests.exceptions.HTTPError as e:
             logger.exception(e)
@@ -64,14 +118,14 @@ def downloadFile(url, destfile):
                 "".join([random.choice(
                     string.ascii_letters + string.digits) for _ in range(6)])
 
-    response = requests.get(url, stream=True)
+    response = getSession().get(url, stream=True)
 
     if not response.ok:
         # Something went wrong
         response.raise_for_status()
 
     with open(temp_file, 'wb') as handle:
-        for block in response.iter_content(1024):
+        for block in response.iter_content(1024 * 1024):
             if not block:
                 break
             handle.write(block)
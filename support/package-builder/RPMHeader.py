@@ -0,0 +1,207 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Reader of the lead and headers of RPM files, so that RPM metadata can be
+# read without spawning rpm -qp. An RPM file is
+#   lead (96 bytes)
+#   signature header, padded to a multiple of 8 bytes
+#   header
+#   payload
+# A header is an 8 byte magic, the number of index entries and the size
+# of the data store (32 bit big endian each), the index entries (tag,
+# type, offset into the data store, count) and the data store.
+
+import struct
+
+class RPMHeader(object):
+
+    leadMagic = b"\xed\xab\xee\xdb"
+    leadSize = 96
+    headerMagic = b"\x8e\xad\xe8\x01"
+
+    # tag types
+    typeNull = 0
+    typeChar = 1
+    typeInt8 = 2
+    typeInt16 = 3
+    typeInt32 = 4
+    typeInt64 = 5
+    typeString = 6
+    typeBin = 7
+    typeStringArray = 8
+    typeI18NString = 9
+
+    # header tags
+    tagName = 1000
+    tagVersion = 1001
+    tagRelease = 1002
+    tagEpoch = 1003
+    tagSummary = 1004
+    tagDescription = 1005
+    tagBuildTime = 1006
+    tagBuildHost = 1007
+    tagSize = 1009
+    tagVendor = 1011
+    tagLicense = 1014
+    tagPackager = 1015
+    tagGroup = 1016
+    tagURL = 1020
+    tagArch = 1022
+    tagFileSizes = 1028
+    tagFileModes = 1030
+    tagFileFlags = 1037
+    tagSourceRPM = 1044
+    tagArchiveSize = 1046
+    tagProvideName = 1047
+    tagRequireFlags = 1048
+    tagRequireName = 1049
+    tagRequireVersion = 1050
+    tagConflictFlags = 1053
+    tagConflictName = 1054
+    tagConflictVersion = 1055
+    tagChangelogTime = 1080
+    tagChangelogName = 1081
+    tagChangelogText = 1082
+    tagObsoleteName = 1090
+    tagProvideFlags = 1112
+    tagProvideVersion = 1113
+    tagObsoleteFlags = 1114
+    tagObsoleteVersion = 1115
+    tagDirIndexes = 1116
+    tagBaseNames = 1117
+    tagDirNames = 1118
+    tagLongSize = 5009
+
+    # signature header tags
+    sigTagLongArchiveSize = 271
+    sigTagPayloadSize = 1007
+
+    def __init__(self, rpmFile):
+        self.rpmFile = rpmFile
+        # map tag to value of the signature header and of the header
+        self.signatureTags = {}
+        self.tags = {}
+        # byte offsets of the header in the file, and of the payload
+        self.headerStart = 0
+        self.headerEnd = 0
+        with open(rpmFile, 'rb') as f:
+            lead = f.read(RPMHeader.leadSize)
+            if len(lead) != RPMHeader.leadSize or lead[:4] != RPMHeader.leadMagic:
+                raise Exception("Not an RPM file: " + rpmFile)
+            self.signatureTags, signatureSize = self._readHeader(f)
+            # the signature header is padded to 8 bytes
+            f.seek((8 - signatureSize % 8) % 8, 1)
+            self.headerStart = f.tell()
+            self.tags, headerSize = self._readHeader(f)
+            self.headerEnd = self.headerStart + headerSize
+
+    def get(self, tag, default=None):
+        return self.tags.get(tag, default)
+
+    def getName(self):
+        return self.tags[RPMHeader.tagName]
+
+    def getEpoch(self):
+        epoch = self.tags.get(RPMHeader.tagEpoch)
+        if epoch is None:
+            return 0
+        return epoch[0]
+
+    def getVersion(self):
+        return self.tags[RPMHeader.tagVersion]
+
+    def getRelease(self):
+        return self.tags[RPMHeader.tagRelease]
+
+    def getArch(self):
+        # source RPMs have the arch of the build host in the header
+        if RPMHeader.tagSourceRPM not in self.tags:
+            return "src"
+        return self.tags[RPMHeader.tagArch]
+
+    def getEVR(self):
+        evr = self.getVersion() + "-" + self.getRelease()
+        if self.getEpoch():
+            evr = str(self.getEpoch()) + ":" + evr
+        return evr
+
+    # Size of the uncompressed payload
+    def getPayloadSize(self):
+        for tags, tag in [(self.signatureTags, RPMHeader.sigTagLongArchiveSize),
+                          (self.signatureTags, RPMHeader.sigTagPayloadSize),
+                          (self.tags, RPMHeader.tagArchiveSize)]:
+            if tag in tags:
+                return tags[tag][0]
+        return None
+
+    # Returns list of (name, flags, version) of a dependency type
+    def getDependencies(self, nameTag, flagsTag, versionTag):
+        names = self.tags.get(nameTag, [])
+        flags = self.tags.get(flagsTag, [0] * len(names))
+        versions = self.tags.get(versionTag, [""] * len(names))
+        return list(zip(names, flags, versions))
+
+    def getProvides(self):
+        return self.getDependencies(RPMHeader.tagProvideName, RPMHeader.tagProvideFlags,
+                                    RPMHeader.tagProvideVersion)
+
+    def getRequires(self):
+        return self.getDependencies(RPMHeader.tagRequireName, RPMHeader.tagRequireFlags,
+                                    RPMHeader.tagRequireVersion)
+
+    def getConflicts(self):
+        return self.getDependencies(RPMHeader.tagConflictName, RPMHeader.tagConflictFlags,
+                                    RPMHeader.tagConflictVersion)
+
+    def getObsoletes(self):
+        return self.getDependencies(RPMHeader.tagObsoleteName, RPMHeader.tagObsoleteFlags,
+                                    RPMHeader.tagObsoleteVersion)
+
+    def getFiles(self):
+        dirNames = self.tags.get(RPMHeader.tagDirNames, [])
+        return [dirNames[dirIndex] + baseName
+                for dirIndex, baseName in zip(self.tags.get(RPMHeader.tagDirIndexes, []),
+                                              self.tags.get(RPMHeader.tagBaseNames, []))]
+
+    # Returns (map of tag to value, size in bytes) of the header at the
+    # current position of f
+    def _readHeader(self, f):
+        intro = f.read(16)
+        if len(intro) != 16 or intro[:4] != RPMHeader.headerMagic:
+            raise Exception("Bad RPM header in " + self.rpmFile)
+        numEntries, dataSize = struct.unpack(">II", intro[8:])
+        index = f.read(numEntries * 16)
+        data = f.read(dataSize)
+        if len(index) != numEntries * 16 or len(data) != dataSize:
+            raise Exception("Truncated RPM header in " + self.rpmFile)
+
+        tags = {}
+        for i in range(numEntries):
+            tag, tagType, offset, count = struct.unpack(">IIII", index[i * 16:i * 16 + 16])
+            tags[tag] = RPMHeader._readValue(data, tagType, offset, count)
+        return tags, 16 + len(index) + dataSize
+
+    @staticmethod
+    def _readValue(data, tagType, offset, count):
+        if tagType in [RPMHeader.typeChar, RPMHeader.typeInt8]:
+            return list(data[offset:offset + count])
+        if tagType == RPMHeader.typeInt16:
+            return list(struct.unpack_from(">%dH" % count, data, offset))
+        if tagType == RPMHeader.typeInt32:
+            return list(struct.unpack_from(">%dI" % count, data, offset))
+        if tagType == RPMHeader.typeInt64:
+            return list(struct.unpack_from(">%dQ" % count, data, offset))
+        if tagType == RPMHeader.typeBin:
+            return data[offset:offset + count]
+        if tagType in [RPMHeader.typeString, RPMHeader.typeStringArray,
+                       RPMHeader.typeI18NString]:
+            strings = []
+            for _ in range(count):
+                end = data.index(b"\0", offset)
+                strings.append(data[offset:end].decode("utf-8", "replace"))
+                offset = end + 1
+            # STRING tags hold a single string, I18NSTRING tags hold the
+            # translations of which the first is the default one
+            if tagType != RPMHeader.typeStringArray:
+                return strings[0]
+            return strings
+        return None
@@ -0,0 +1,162 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Index of the RPM files below the RPM directories (stage/RPMS, input
+# RPMs, PUBLISHRPMS, ...), answering lookups by file name or by package
+# name from memory instead of stat calls and find processes. A directory
+# tree is scanned once, on its first lookup. RPMs written by builds are
+# added with addFiles once rpmbuild finished, since a directory written
+# in the same mtime tick as its last scan does not look changed. A lookup
+# which misses rescans the directories changed since they were scanned,
+# so RPMs written by other processes are found too.
+
+import os
+import threading
+
+class RPMIndex(object):
+
+    lock = threading.Lock()
+    # map root directory to its _DirectoryTreeIndex
+    mapRootToIndex = {}
+
+    # Returns whether path below rootPath is an indexed file
+    @staticmethod
+    def isFile(rootPath, path):
+        path = os.path.normpath(path)
+        with RPMIndex.lock:
+            index = RPMIndex._getIndex(rootPath)
+            if path not in index.paths:
+                index.refresh()
+            return path in index.paths
+
+    # Returns paths of the files named fileName below rootPath
+    @staticmethod
+    def findFile(rootPath, fileName):
+        with RPMIndex.lock:
+            index = RPMIndex._getIndex(rootPath)
+            if not index.mapFileNameToPaths.get(fileName):
+                index.refresh()
+            return sorted(index.mapFileNameToPaths.get(fileName, []))
+
+    # Returns paths of the RPM files of package rpmName below rootPath
+    @staticmethod
+    def findRPMs(rootPath, rpmName):
+        with RPMIndex.lock:
+            index = RPMIndex._getIndex(rootPath)
+            if not index.mapRPMNameToPaths.get(rpmName):
+                index.refresh()
+            return sorted(index.mapRPMNameToPaths.get(rpmName, []))
+
+    # Adds files written below rootPath. Nothing is done if rootPath is
+    # not indexed yet, its first lookup scans it.
+    @staticmethod
+    def addFiles(rootPath, files):
+        with RPMIndex.lock:
+            if rootPath not in RPMIndex.mapRootToIndex:
+                return
+            index = RPMIndex.mapRootToIndex[rootPath]
+            for f in files:
+                index.addFile(f)
+
+    @staticmethod
+    def clear():
+        with RPMIndex.lock:
+            RPMIndex.mapRootToIndex = {}
+
+    # Must be called with RPMIndex.lock held
+    @staticmethod
+    def _getIndex(rootPath):
+        if rootPath not in RPMIndex.mapRootToIndex:
+            index = _DirectoryTreeIndex(rootPath)
+            index.refresh()
+            RPMIndex.mapRootToIndex[rootPath] = index
+        return RPMIndex.mapRootToIndex[rootPath]
+
+    # name-version-release.arch.rpm
+    @staticmethod
+    def getRPMName(fileName):
+        if not fileName.endswith(".rpm"):
+            return None
+        parts = fileName.rsplit("-", 2)
+        if len(parts) != 3:
+            return None
+        return parts[0]
+
+
+class _DirectoryTreeIndex(object):
+
+    def __init__(self, rootPath):
+        self.rootPath = rootPath
+        # map directory to its mtime when it was scanned, symlinks are
+        # followed like find -L does
+        self.mapDirToMtime = {}
+        # map directory to its files and subdirectories, files are keyed
+        # by the normalized directory path
+        self.mapDirToFiles = {}
+        self.mapDirToSubDirs = {}
+        self.paths = set()
+        self.mapFileNameToPaths = {}
+        self.mapRPMNameToPaths = {}
+
+    # Scans directories which are new or changed since the last scan
+    def refresh(self):
+        dirsToScan = [self.rootPath]
+        scannedRealPaths = set()
+        while dirsToScan:
+            dirPath = dirsToScan.pop()
+            try:
+                dirStat = os.stat(dirPath)
+            except OSError:
+                continue
+            realPath = os.path.realpath(dirPath)
+            if realPath in scannedRealPaths:
+                continue
+            scannedRealPaths.add(realPath)
+            if self.mapDirToMtime.get(dirPath) != dirStat.st_mtime_ns:
+                self.mapDirToMtime[dirPath] = dirStat.st_mtime_ns
+                self._scanDirectory(dirPath)
+            dirsToScan.extend(self.mapDirToSubDirs[dirPath])
+
+    def _scanDirectory(self, dirPath):
+        files = set()
+        subDirs = []
+        with os.scandir(dirPath) as entries:
+            for entry in entries:
+                try:
+                    isDir = entry.is_dir()
+                except OSError:
+                    continue
+                if isDir:
+                    subDirs.append(entry.path)
+                else:
+                    files.add(os.path.normpath(entry.path))
+        # files added by builds are removed too if they are gone
+        for path in self.mapDirToFiles.get(os.path.normpath(dirPath), set()) - files:
+            self._removeFile(path)
+        for path in files:
+            self.addFile(path)
+        self.mapDirToFiles[os.path.normpath(dirPath)] = files
+        self.mapDirToSubDirs[dirPath] = subDirs
+
+    # Paths are kept normalized, so that files added by builds and found
+    # by scans are the same entries
+    def addFile(self, path):
+        path = os.path.normpath(path)
+        if path in self.paths:
+            return
+        self.paths.add(path)
+        self.mapDirToFiles.setdefault(os.path.dirname(path), set()).add(path)
+        fileName = os.path.basename(path)
+        self.mapFileNameToPaths.setdefault(fileName, set()).add(path)
+        rpmName = RPMIndex.getRPMName(fileName)
+        if rpmName is not None:
+            self.mapRPMNameToPaths.setdefault(rpmName, set()).add(path)
+
+    def _removeFile(self, path):
+        path = os.path.normpath(path)
+        self.paths.discard(path)
+        self.mapDirToFiles.get(os.path.dirname(path), set()).discard(path)
+        fileName = os.path.basename(path)
+        self.mapFileNameToPaths.get(fileName, set()).discard(path)
+        rpmName = RPMIndex.getRPMName(fileName)
+        if rpmName is not None:
+            self.mapRPMNameToPaths.get(rpmName, set()).discard(path)
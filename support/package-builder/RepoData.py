@@ -0,0 +1,390 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Keeps the repository metadata (repodata/repomd.xml with primary,
+# filelists and other XML) of stage/RPMS up to date while packages are
+# built, so that the repository is usable as soon as the build finishes
+# without running createrepo over all RPMs.
+#
+# The metadata of every RPM is generated once from its header and kept,
+# together with the size and mtime of the RPM file, in
+# repodata/package-cache.json. Later runs only read the headers of RPM
+# files which are new or changed. A writer thread regenerates the
+# metadata files from the cached package metadata whenever packages were
+# built since the last write.
+
+import gzip
+import hashlib
+import json
+import os
+import stat
+import threading
+import time
+from xml.sax.saxutils import escape, quoteattr
+from BuiltRPMIndex import BuiltRPMIndex
+from RPMHeader import RPMHeader
+
+class RepoData(object):
+
+    lock = threading.Lock()
+    # Signalled when RPM files are added or the writer has to stop
+    condition = threading.Condition(lock)
+    repoPath = None
+    logger = None
+    writerThread = None
+    stopWriting = True
+    # RPM files to (re)read and write to the metadata
+    pendingRPMFiles = set()
+    # map path relative to repoPath to cached metadata of the RPM file
+    mapPathToPackage = {}
+
+    cacheFileName = "package-cache.json"
+    # version of the cached package metadata
+    cacheVersion = 1
+    numChangelogs = 10
+
+    @staticmethod
+    def start(repoPath, logger):
+        RepoData.repoPath = repoPath
+        RepoData.logger = logger
+        RepoData.pendingRPMFiles = set()
+        RepoData.stopWriting = False
+        RepoData.writerThread = threading.Thread(target=RepoData._writeRepoData,
+                                                 name="RepoDataWriter")
+        RepoData.writerThread.start()
+
+    # Writes the metadata of the pending RPM files and waits for the writer
+    @staticmethod
+    def stop():
+        if RepoData.writerThread is None:
+            return
+        with RepoData.condition:
+            RepoData.stopWriting = True
+            RepoData.condition.notify_all()
+        RepoData.writerThread.join()
+        RepoData.writerThread = None
+
+    @staticmethod
+    def isRunning():
+        return RepoData.writerThread is not None
+
+    # Adds the RPMs of a built package to the metadata
+    @staticmethod
+    def addPackage(package, version):
+        if not RepoData.isRunning():
+            return
+        rpmFiles = [entry["path"] for entry in BuiltRPMIndex.getPackage(package, version)
+                    if entry["arch"] != "src"]
+        with RepoData.condition:
+            RepoData.pendingRPMFiles.update(rpmFiles)
+            RepoData.condition.notify_all()
+
+    @staticmethod
+    def _writeRepoData():
+        try:
+            RepoData._loadPackages()
+            RepoData._writeMetadata()
+        except Exception as e:
+            RepoData.logger.error("Unable to write repodata of " + RepoData.repoPath)
+            RepoData.logger.exception(e)
+        while True:
+            with RepoData.condition:
+                while not RepoData.stopWriting and not RepoData.pendingRPMFiles:
+                    RepoData.condition.wait()
+                if not RepoData.pendingRPMFiles:
+                    return
+                rpmFiles = RepoData.pendingRPMFiles
+                RepoData.pendingRPMFiles = set()
+            try:
+                changed = False
+                for rpmFile in sorted(rpmFiles):
+                    changed = RepoData._addRPMFile(rpmFile) or changed
+                if changed:
+                    RepoData._writeMetadata()
+            except Exception as e:
+                RepoData.logger.error("Unable to write repodata of " + RepoData.repoPath)
+                RepoData.logger.exception(e)
+
+    # Reads the RPM files present in the repository, reusing the metadata
+    # cached for unchanged files
+    @staticmethod
+    def _loadPackages():
+        cachedPackages = {}
+        cacheFile = os.path.join(RepoData.repoPath, "repodata", RepoData.cacheFileName)
+        if os.path.isfile(cacheFile):
+            try:
+                with open(cacheFile, 'r') as f:
+                    cache = json.load(f)
+                if cache.get("version") == RepoData.cacheVersion:
+                    cachedPackages = cache["packages"]
+            except (OSError, ValueError, KeyError):
+                RepoData.logger.debug("Ignoring invalid repodata cache " + cacheFile)
+
+        RepoData.mapPathToPackage = {}
+        for dirPath, dirNames, fileNames in os.walk(RepoData.repoPath):
+            if dirPath == RepoData.repoPath and "repodata" in dirNames:
+                dirNames.remove("repodata")
+            for fileName in fileNames:
+                if not fileName.endswith(".rpm") or fileName.endswith(".src.rpm"):
+                    continue
+                rpmFile = os.path.join(dirPath, fileName)
+                relPath = os.path.relpath(rpmFile, RepoData.repoPath)
+                fileStat = os.stat(rpmFile)
+                cachedPackage = cachedPackages.get(relPath)
+                if (cachedPackage is not None and
+                        cachedPackage["size"] == fileStat.st_size and
+                        cachedPackage["mtime"] == fileStat.st_mtime_ns):
+                    RepoData.mapPathToPackage[relPath] = cachedPackage
+                else:
+                    RepoData._addRPMFile(rpmFile)
+
+    # Returns whether the metadata of the RPM file changed
+    @staticmethod
+    def _addRPMFile(rpmFile):
+        relPath = os.path.relpath(rpmFile, RepoData.repoPath)
+        try:
+            fileStat = os.stat(rpmFile)
+        except FileNotFoundError:
+            return RepoData.mapPathToPackage.pop(relPath, None) is not None
+        cachedPackage = RepoData.mapPathToPackage.get(relPath)
+        if (cachedPackage is not None and
+                cachedPackage["size"] == fileStat.st_size and
+                cachedPackage["mtime"] == fileStat.st_mtime_ns):
+            return False
+        RepoData.mapPathToPackage[relPath] = _PackageMetadata(rpmFile, relPath,
+                                                              fileStat).toDict()
+        return True
+
+    @staticmethod
+    def _writeMetadata():
+        repoDataPath = os.path.join(RepoData.repoPath, "repodata")
+        os.makedirs(repoDataPath, exist_ok=True)
+        # RPM files removed since they were added
+        for relPath in list(RepoData.mapPathToPackage.keys()):
+            if not os.path.isfile(os.path.join(RepoData.repoPath, relPath)):
+                del RepoData.mapPathToPackage[relPath]
+        packages = [RepoData.mapPathToPackage[relPath]
+                    for relPath in sorted(RepoData.mapPathToPackage.keys())]
+
+        timestamp = int(time.time())
+        listData = []
+        dataFileNames = set()
+        for dataType, rootElement, namespaces in [
+                ("primary", "metadata", 'xmlns="http://linux.duke.edu/metadata/common" '
+                                        'xmlns:rpm="http://linux.duke.edu/metadata/rpm"'),
+                ("filelists", "filelists", 'xmlns="http://linux.duke.edu/metadata/filelists"'),
+                ("other", "otherdata", 'xmlns="http://linux.duke.edu/metadata/other"')]:
+            content = ('<?xml version="1.0" encoding="UTF-8"?>\n' +
+                       '<' + rootElement + ' ' + namespaces + ' packages="' +
+                       str(len(packages)) + '">\n' +
+                       "".join(package[dataType] for package in packages) +
+                       '</' + rootElement + '>\n').encode("utf-8")
+            data, dataFileName = RepoData._writeDataFile(repoDataPath, dataType, content,
+                                                         timestamp)
+            listData.append(data)
+            dataFileNames.add(dataFileName)
+
+        repomd = ('<?xml version="1.0" encoding="UTF-8"?>\n' +
+                  '<repomd xmlns="http://linux.duke.edu/metadata/repo" ' +
+                  'xmlns:rpm="http://linux.duke.edu/metadata/rpm">\n' +
+                  '  <revision>' + str(timestamp) + '</revision>\n' +
+                  "".join(listData) +
+                  '</repomd>\n')
+        RepoData._replaceFile(os.path.join(repoDataPath, "repomd.xml"),
+                              repomd.encode("utf-8"))
+        RepoData._replaceFile(os.path.join(repoDataPath, RepoData.cacheFileName),
+                              json.dumps({"version": RepoData.cacheVersion,
+                                          "packages": RepoData.mapPathToPackage}).encode("utf-8"))
+
+        # data files of earlier metadata
+        for fileName in os.listdir(repoDataPath):
+            if fileName.endswith(".xml.gz") and fileName not in dataFileNames:
+                os.remove(os.path.join(repoDataPath, fileName))
+        RepoData.logger.debug("Wrote repodata of " + str(len(packages)) + " RPMs to " +
+                              repoDataPath)
+
+    # Writes a compressed data file, named after its checksum, and returns
+    # (repomd.xml data element, file name)
+    @staticmethod
+    def _writeDataFile(repoDataPath, dataType, content, timestamp):
+        compressedContent = gzip.compress(content, mtime=0)
+        checksum = hashlib.sha256(compressedContent).hexdigest()
+        fileName = checksum + "-" + dataType + ".xml.gz"
+        if not os.path.isfile(os.path.join(repoDataPath, fileName)):
+            RepoData._replaceFile(os.path.join(repoDataPath, fileName), compressedContent)
+        data = ('  <data type="' + dataType + '">\n' +
+                '    <checksum type="sha256">' + checksum + '</checksum>\n' +
+                '    <open-checksum type="sha256">' + hashlib.sha256(content).hexdigest() +
+                '</open-checksum>\n' +
+                '    <location href="repodata/' + fileName + '"/>\n' +
+                '    <timestamp>' + str(timestamp) + '</timestamp>\n' +
+                '    <size>' + str(len(compressedContent)) + '</size>\n' +
+                '    <open-size>' + str(len(content)) + '</open-size>\n' +
+                '  </data>\n')
+        return data, fileName
+
+    @staticmethod
+    def _replaceFile(path, content):
+        with open(path + ".tmp", 'wb') as f:
+            f.write(content)
+        os.rename(path + ".tmp", path)
+
+
+# Primary, filelists and other XML of an RPM file, like createrepo writes
+class _PackageMetadata(object):
+
+    senseLess = 1 << 1
+    senseGreater = 1 << 2
+    senseEqual = 1 << 3
+    # requires of scriptlets
+    sensePreReq = (1 << 6) | (1 << 9) | (1 << 10) | (1 << 11) | (1 << 12)
+    senseRPMLib = 1 << 24
+    fileFlagGhost = 1 << 6
+
+    mapFlagsToName = {senseLess: "LT", senseGreater: "GT", senseEqual: "EQ",
+                      senseLess | senseEqual: "LE", senseGreater | senseEqual: "GE"}
+
+    def __init__(self, rpmFile, relPath, fileStat):
+        self.header = RPMHeader(rpmFile)
+        self.relPath = relPath
+        self.fileStat = fileStat
+        entry = BuiltRPMIndex.getEntry(rpmFile)
+        if entry is not None and entry["size"] == fileStat.st_size:
+            self.checksum = entry["sha256"]
+        else:
+            sha256 = hashlib.sha256()
+            with open(rpmFile, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            self.checksum = sha256.hexdigest()
+
+    def toDict(self):
+        return {"size": self.fileStat.st_size,
+                "mtime": self.fileStat.st_mtime_ns,
+                "primary": self._getPrimary(),
+                "filelists": self._getFilelists(),
+                "other": self._getOther()}
+
+    def _getPrimary(self):
+        header = self.header
+        xml = ('<package type="rpm">\n' +
+               '  <name>' + escape(header.getName()) + '</name>\n' +
+               '  <arch>' + escape(header.getArch()) + '</arch>\n' +
+               '  ' + self._getVersion() + '\n' +
+               '  <checksum type="sha256" pkgid="YES">' + self.checksum + '</checksum>\n' +
+               '  <summary>' + self._getText(RPMHeader.tagSummary) + '</summary>\n' +
+               '  <description>' + self._getText(RPMHeader.tagDescription) +
+               '</description>\n' +
+               '  <packager>' + self._getText(RPMHeader.tagPackager) + '</packager>\n' +
+               '  <url>' + self._getText(RPMHeader.tagURL) + '</url>\n' +
+               '  <time file="' + str(int(self.fileStat.st_mtime)) + '" build="' +
+               str(header.get(RPMHeader.tagBuildTime, [0])[0]) + '"/>\n' +
+               '  <size package="' + str(self.fileStat.st_size) + '" installed="' +
+               str((header.get(RPMHeader.tagLongSize) or
+                    header.get(RPMHeader.tagSize, [0]))[0]) +
+               '" archive="' + str(header.getPayloadSize() or 0) + '"/>\n' +
+               '  <location href=' + quoteattr(self.relPath) + '/>\n' +
+               '  <format>\n' +
+               '    <rpm:license>' + self._getText(RPMHeader.tagLicense) + '</rpm:license>\n' +
+               '    <rpm:vendor>' + self._getText(RPMHeader.tagVendor) + '</rpm:vendor>\n' +
+               '    <rpm:group>' + self._getText(RPMHeader.tagGroup) + '</rpm:group>\n' +
+               '    <rpm:buildhost>' + self._getText(RPMHeader.tagBuildHost) +
+               '</rpm:buildhost>\n' +
+               '    <rpm:sourcerpm>' + self._getText(RPMHeader.tagSourceRPM) +
+               '</rpm:sourcerpm>\n' +
+               '    <rpm:header-range start="' + str(header.headerStart) + '" end="' +
+               str(header.headerEnd) + '"/>\n')
+        requires = [(name, flags, version) for name, flags, version in header.getRequires()
+                    if not flags & _PackageMetadata.senseRPMLib]
+        for depType, dependencies in [("provides", header.getProvides()),
+                                      ("requires", requires),
+                                      ("conflicts", header.getConflicts()),
+                                      ("obsoletes", header.getObsoletes())]:
+            if not dependencies:
+                continue
+            xml += '    <rpm:' + depType + '>\n'
+            for dependency in sorted(set(dependencies)):
+                xml += '      ' + self._getDependency(depType, *dependency) + '\n'
+            xml += '    </rpm:' + depType + '>\n'
+        for path, fileType in self._getFiles():
+            if (path.startswith("/etc/") or "bin/" in path or
+                    path == "/usr/lib/sendmail"):
+                xml += '    ' + self._getFile(path, fileType) + '\n'
+        xml += '  </format>\n</package>\n'
+        return xml
+
+    def _getFilelists(self):
+        xml = ('<package pkgid="' + self.checksum + '" name=' +
+               quoteattr(self.header.getName()) + ' arch=' +
+               quoteattr(self.header.getArch()) + '>\n' +
+               '  ' + self._getVersion() + '\n')
+        for path, fileType in self._getFiles():
+            xml += '  ' + self._getFile(path, fileType) + '\n'
+        return xml + '</package>\n'
+
+    def _getOther(self):
+        header = self.header
+        xml = ('<package pkgid="' + self.checksum + '" name=' +
+               quoteattr(header.getName()) + ' arch=' + quoteattr(header.getArch()) + '>\n' +
+               '  ' + self._getVersion() + '\n')
+        changelogs = list(zip(header.get(RPMHeader.tagChangelogTime, []),
+                              header.get(RPMHeader.tagChangelogName, []),
+                              header.get(RPMHeader.tagChangelogText, [])))
+        # the newest changelog entries come first
+        for changelogTime, author, text in reversed(changelogs[:RepoData.numChangelogs]):
+            xml += ('  <changelog author=' + quoteattr(author) + ' date="' +
+                    str(changelogTime) + '">' + escape(text) + '</changelog>\n')
+        return xml + '</package>\n'
+
+    def _getVersion(self):
+        return ('<version epoch="' + str(self.header.getEpoch()) + '" ver=' +
+                quoteattr(self.header.getVersion()) + ' rel=' +
+                quoteattr(self.header.getRelease()) + '/>')
+
+    def _getText(self, tag):
+        value = self.header.get(tag)
+        if value is None:
+            return ""
+        return escape(value)
+
+    # Returns list of (path, type) of the files of the RPM
+    def _getFiles(self):
+        paths = self.header.getFiles()
+        modes = self.header.get(RPMHeader.tagFileModes, [0] * len(paths))
+        flags = self.header.get(RPMHeader.tagFileFlags, [0] * len(paths))
+        files = []
+        for path, mode, fileFlags in zip(paths, modes, flags):
+            fileType = None
+            if fileFlags & _PackageMetadata.fileFlagGhost:
+                fileType = "ghost"
+            elif stat.S_ISDIR(mode):
+                fileType = "dir"
+            files.append((path, fileType))
+        return files
+
+    @staticmethod
+    def _getFile(path, fileType):
+        if fileType is None:
+            return '<file>' + escape(path) + '</file>'
+        return '<file type="' + fileType + '">' + escape(path) + '</file>'
+
+    @staticmethod
+    def _getDependency(depType, name, flags, version):
+        xml = '<rpm:entry name=' + quoteattr(name)
+        flagsName = _PackageMetadata.mapFlagsToName.get(
+            flags & (_PackageMetadata.senseLess | _PackageMetadata.senseGreater |
+                     _PackageMetadata.senseEqual))
+        if flagsName is not None and version:
+            # [epoch:]version[-release]
+            epoch = "0"
+            if ":" in version:
+                epoch, version = version.split(":", 1)
+            release = None
+            if "-" in version:
+                version, release = version.rsplit("-", 1)
+            xml += ' flags="' + flagsName + '" epoch=' + quoteattr(epoch)
+            xml += ' ver=' + quoteattr(version)
+            if release is not None:
+                xml += ' rel=' + quoteattr(release)
+        if depType == "requires" and flags & _PackageMetadata.sensePreReq:
+            xml += ' pre="1"'
+        return xml + '/>'
@@ -2,6 +2,13 @@ import sys
 import os.path
 import subprocess
 import shutil
+import hashlib
+import fcntl
+import json
+import pwd
+import threading
+import tarfile
+import tempfile
 import docker
 from constants import constants
 from Logger import Logger
@@ -23,12 +30,27 @@ class Sandbox(object):
     def put(self, src, dest):
         pass
 
+    # Puts files into directory dest of the sandbox, for sandboxes which
+    # are not expected to change them
+    def putFiles(self, files, dest):
+        for f in files:
+            self.put(f, dest)
+
     def getID(self):
         pass
 
     def hasToolchain(self):
         return False
 
+    # installFn(sandbox, rpmFiles) installs toolchain RPM files into the
+    # sandbox root
+    def installToolchain(self, rpmFiles, installFn):
+        installFn(self, rpmFiles)
+
+    # installFn() installs given RPM files into the sandbox
+    def installPackages(self, rpmFiles, installFn):
+        installFn()
+
 class Chroot(Sandbox):
     def __init__(self, logger):
         Sandbox.__init__(self, logger)
@@ -37,6 +59,8 @@ class Chroot(Sandbox):
         self.runInChrootCommand = ("./run-in-chroot.sh " + constants.sourcePath +
                                    " " + constants.rpmPath)
         self.chrootCmdPrefix = None
+        # directories of the build root showing a file farm
+        self.fileFarmDirs = set()
 
     def getID(self):
         return self.chrootID
@@ -57,24 +81,17 @@ class Chroot(Sandbox):
             raise Exception("Unable to create chroot: " + chrootID + ". Unknown error.")
         self.logger.debug("Created new chroot: " + chrootID)
 
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/dev")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/etc")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/proc")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/run")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/sys")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/tmp")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/publishrpms")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/publishxrpms")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + "/inputrpms")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath)
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/RPMS")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/SRPMS")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/SOURCES")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/SPECS")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/LOGS")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/BUILD")
-        cmdUtils.runCommandInShell("mkdir -p " + chrootID + constants.topDirPath + "/BUILDROOT")
+        self._prepareChroot(chrootID)
+
+        self.chrootID = chrootID
+        self.chrootCmdPrefix = self.runInChrootCommand + " " + chrootID + " "
+        self.fileFarmDirs = set()
+
+    # Creates the directory layout and mounts of a build root
+    def _prepareChroot(self, chrootID):
+        self._createBuildRootDirs(chrootID)
 
+        cmdUtils = CommandUtils()
         prepareChrootCmd = self.prepareBuildRootCmd + " " + chrootID
         returnVal = cmdUtils.runCommandInShell(prepareChrootCmd, logfn=self.logger.debug)
         if returnVal != 0:
@@ -96,8 +113,18 @@ class Chroot(Sandbox):
 
         self.logger.debug("Successfully created chroot:" + chrootID)
 
-        self.chrootID = chrootID
-        self.chrootCmdPrefix = self.runInChrootCommand + " " + chrootID + " "
+    def _createBuildRootDirs(self, chrootID):
+        for directory in ["/dev", "/etc", "/proc", "/run", "/sys", "/tmp",
+                          "/publishrpms", "/publishxrpms", "/inputrpms",
+                          constants.topDirPath,
+                          constants.topDirPath + "/RPMS",
+                          constants.topDirPath + "/SRPMS",
+                          constants.topDirPath + "/SOURCES",
+                          constants.topDirPath + "/SPECS",
+                          constants.topDirPath + "/LOGS",
+                          constants.topDirPath + "/BUILD",
+                          constants.topDirPath + "/BUILDROOT"]:
+            os.makedirs(chrootID + directory, exist_ok=True)
 
     def destroy(self):
         self._destroy(self.chrootID)
@@ -109,6 +136,8 @@ class Chroot(Sandbox):
         self.logger.debug("Deleting chroot: " + chrootID)
         self._unmountAll(chrootID)
         self._removeChroot(chrootID)
+        if os.path.isdir(chrootID + ".files"):
+            self._removeChroot(chrootID + ".files")
 
     def run(self, cmd, logfile=None, logfn=None):
         self.logger.debug("Chroot.run() cmd: " + self.chrootCmdPrefix + cmd)
@@ -118,6 +147,79 @@ class Chroot(Sandbox):
     def put(self, src, dest):
         shutil.copy2(src, self.chrootID + dest)
 
+    # The files are hardlinked into a farm next to the build root, which
+    # is the lower directory of an overlay mounted onto dest. The build can
+    # change the files (e.g. sed -i a source), the changes are copied up to
+    # the upper directory and the originals stay untouched. Files on
+    # another file system are reflinked, or copied where reflinks are not
+    # supported. Without root, or if the overlay can not be mounted, the
+    # files are reflinked or copied into the build root directly.
+    def putFiles(self, files, dest):
+        if not files:
+            return
+        if dest in self.fileFarmDirs:
+            self._addToFileFarm(files, dest)
+            return
+        if not self._canMountFileFarm():
+            self._linkFiles(files, self.chrootID + dest, hardlink=False)
+            return
+        farmDir = self._getFileFarmDir("lower", dest)
+        os.makedirs(farmDir, exist_ok=True)
+        os.makedirs(self._getFileFarmDir("upper", dest), exist_ok=True)
+        os.makedirs(self._getFileFarmDir("work", dest), exist_ok=True)
+        self._linkFiles(files, farmDir, hardlink=True)
+        if self._mountFileFarm(dest):
+            self.fileFarmDirs.add(dest)
+        else:
+            self._linkFiles(files, self.chrootID + dest, hardlink=False)
+
+    # Runs cmd outside of the build root, with the privileges needed to
+    # change files of the build root
+    def runOnHost(self, cmd, logfn=None):
+        return CommandUtils.runCommandInShell(cmd, logfn=logfn)
+
+    def _canMountFileFarm(self):
+        return os.geteuid() == 0
+
+    # Directory kind ("lower", "upper" or "work") of the file farm of dest
+    def _getFileFarmDir(self, kind, dest):
+        return self.chrootID + ".files/" + kind + dest
+
+    # Returns whether the overlay of the file farm of dest is mounted
+    def _mountFileFarm(self, dest):
+        cmd = ("mount -t overlay overlay -o lowerdir=" + self._getFileFarmDir("lower", dest) +
+               ",upperdir=" + self._getFileFarmDir("upper", dest) +
+               ",workdir=" + self._getFileFarmDir("work", dest) + " " + self.chrootID + dest)
+        return CommandUtils.runCommandInShell(cmd, logfn=self.logger.debug) == 0
+
+    # The lower directory of a mounted overlay must not change, files put
+    # later are copied through the overlay
+    def _addToFileFarm(self, files, dest):
+        self._linkFiles(files, self.chrootID + dest, hardlink=False)
+
+    def _linkFiles(self, files, destDir, hardlink):
+        filesToCopy = []
+        for f in files:
+            destFile = os.path.join(destDir, os.path.basename(f))
+            if os.path.lexists(destFile):
+                os.remove(destFile)
+            if not hardlink:
+                filesToCopy.append(f)
+                continue
+            try:
+                os.link(f, destFile)
+            except OSError:
+                filesToCopy.append(f)
+        if filesToCopy:
+            # no shell, file names may contain any character
+            process = subprocess.run(["cp", "--reflink=auto", "--preserve=timestamps", "--"] +
+                                     filesToCopy + [destDir],
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            if process.stdout:
+                self.logger.debug(process.stdout.decode())
+            if process.returncode != 0:
+                raise Exception("Unable to copy files to " + destDir)
+
     def _removeChroot(self, chrootPath):
         cmd = "rm -rf " + chrootPath
         process = subprocess.Popen("%s" %cmd, shell=True,
@@ -164,21 +266,495 @@ class Chroot(Sandbox):
         return listmountpoints
 
 
+# Chroot which is cloned from a pristine toolchain root instead of having
+# the toolchain RPMs installed for every package. The toolchain root is
+# built once per exact set of toolchain RPM files and kept under
+# buildRootPath. Every package gets an overlayfs upper layer on top of it,
+# or a reflink copy (plain copy on file systems without reflinks) where
+# overlayfs is not available. Hardlink copies are not used since package
+# builds may change toolchain files in place.
+#
+# On overlayfs, the result of every RPM install transaction is kept as a
+# dependency layer keyed by the layer below it and the exact RPM files
+# installed, so that builds with the same dependency set mount the layer
+# instead of installing the RPMs again. Toolchain snapshots and layers
+# are evicted in least recently used order once they exceed
+# constants.layerCacheSize.
+class SnapshotChroot(Chroot):
+
+    snapshotDirName = ".toolchain-snapshots"
+    layerDirName = ".dependency-layers"
+
+    def __init__(self, logger):
+        Chroot.__init__(self, logger)
+        self.toolchainInstalled = False
+        # overlayfs lower directories of the chroot, topmost first. Empty
+        # when the chroot is a copy of the toolchain snapshot.
+        self.lowerDirs = []
+        # key of the topmost lower directory plus the RPM files installed
+        # on top of it
+        self.layerKey = None
+
+    # The root is populated later by installToolchain()
+    def create(self, chrootName):
+        if self.chrootID:
+            raise Exception("Unable to create: " + chrootName + ". Chroot is already active: " + self.chrootID)
+
+        chrootID = constants.buildRootPath + "/" + chrootName
+        if os.path.isdir(chrootID) or os.path.isdir(chrootID + ".overlay"):
+            self._destroy(chrootID)
+
+        self.chrootID = chrootID
+        self.chrootCmdPrefix = self.runInChrootCommand + " " + chrootID + " "
+        self.toolchainInstalled = False
+        self.lowerDirs = []
+        self.layerKey = None
+
+    def installToolchain(self, rpmFiles, installFn):
+        if self.toolchainInstalled:
+            installFn(self, rpmFiles)
+            return
+        snapshotPath = self._getToolchainSnapshot(rpmFiles, installFn)
+        os.makedirs(self.chrootID)
+        layerDir = os.path.join(constants.buildRootPath, SnapshotChroot.layerDirName)
+        os.makedirs(layerDir, exist_ok=True)
+        # the shared lock of the snapshot keeps it from being evicted while
+        # it is copied, without blocking other builders
+        with _CacheLock(snapshotPath, shared=True):
+            with _CacheLock(layerDir):
+                mounted = os.geteuid() == 0 and self._mountOverlay([snapshotPath])
+            if not mounted:
+                self.logger.debug("Unable to mount overlayfs, copying toolchain snapshot")
+                self._copySnapshot(snapshotPath, self.chrootID)
+        self._prepareChroot(self.chrootID)
+        self.toolchainInstalled = True
+        self.layerKey = os.path.basename(snapshotPath)
+        self.logger.debug("Created chroot " + self.chrootID + " from toolchain snapshot " +
+                          snapshotPath)
+
+    def installPackages(self, rpmFiles, installFn):
+        if not self.lowerDirs or constants.layerCacheSize <= 0:
+            installFn()
+            return
+
+        layerKey = hashlib.sha1((self.layerKey + "\n" +
+                                 SnapshotChroot._getFilesKey(rpmFiles)).encode()).hexdigest()
+        layerDir = os.path.join(constants.buildRootPath, SnapshotChroot.layerDirName)
+        os.makedirs(layerDir, exist_ok=True)
+        layerPath = os.path.join(layerDir, layerKey)
+        # Builds with the same dependency set wait for the one creating
+        # the layer
+        with _CacheLock(layerPath):
+            with _CacheLock(layerDir):
+                lowerDirs = SnapshotChroot._getLayerLowerDirs(layerPath)
+                if lowerDirs:
+                    os.utime(layerPath)
+                    self._remountOverlay(lowerDirs)
+                    self.logger.debug("Using dependency layer " + layerPath)
+            if not lowerDirs:
+                installFn()
+                self._saveLayer(layerPath)
+                with _CacheLock(layerDir):
+                    SnapshotChroot._evictLayers()
+        self.layerKey = layerKey
+
+    def _destroy(self, chrootID):
+        if not chrootID:
+            return
+        self.logger.debug("Deleting chroot: " + chrootID)
+        self._unmountAll(chrootID)
+        if os.path.ismount(chrootID):
+            self._umount(chrootID)
+        if os.path.isdir(chrootID):
+            self._removeChroot(chrootID)
+        if os.path.isdir(chrootID + ".overlay"):
+            self._removeChroot(chrootID + ".overlay")
+        if os.path.isdir(chrootID + ".files"):
+            self._removeChroot(chrootID + ".files")
+
+    @staticmethod
+    def _getFilesKey(files):
+        filesKey = hashlib.sha1()
+        for f in sorted(files):
+            fileStat = os.stat(f)
+            filesKey.update(("%s %d %d\n" % (f, fileStat.st_size,
+                                             fileStat.st_mtime_ns)).encode())
+        return filesKey.hexdigest()
+
+    # Returns path of the toolchain root for given RPM files, building it
+    # if needed. Concurrent builders wait for the one building it.
+    def _getToolchainSnapshot(self, rpmFiles, installFn):
+        snapshotDir = os.path.join(constants.buildRootPath, SnapshotChroot.snapshotDirName)
+        os.makedirs(snapshotDir, exist_ok=True)
+        snapshotPath = os.path.join(snapshotDir, SnapshotChroot._getFilesKey(rpmFiles))
+        with _CacheLock(snapshotPath):
+            if not os.path.isdir(snapshotPath):
+                self._buildToolchainSnapshot(snapshotPath, rpmFiles, installFn)
+            else:
+                # snapshots are reused in least recently used order
+                os.utime(snapshotPath)
+        return snapshotPath
+
+    def _buildToolchainSnapshot(self, snapshotPath, rpmFiles, installFn):
+        self.logger.debug("Building toolchain snapshot " + snapshotPath)
+        chroot = Chroot(self.logger)
+        chroot.create(os.path.relpath(snapshotPath + ".tmp", constants.buildRootPath))
+        try:
+            installFn(chroot, rpmFiles)
+            chroot.unmountAll()
+        except Exception as e:
+            chroot.destroy()
+            raise e
+        SnapshotChroot._writeCacheInfo(snapshotPath, chroot.getID(), [snapshotPath])
+        os.rename(chroot.getID(), snapshotPath)
+
+    # Keeps the upper layer of the chroot as dependency layer. Must be
+    # called with the lock of the layer held.
+    def _saveLayer(self, layerPath):
+        tmpPath = layerPath + ".tmp"
+        if os.path.isdir(tmpPath):
+            self._removeChroot(tmpPath)
+        # incomplete layer of an interrupted run, or a layer whose lower
+        # directories were evicted
+        if os.path.isdir(layerPath):
+            self.logger.debug("Removing stale dependency layer " + layerPath)
+            self._removeChroot(layerPath)
+        self._copySnapshot(self.chrootID + ".overlay/upper", tmpPath)
+        SnapshotChroot._writeCacheInfo(layerPath, tmpPath, [layerPath] + self.lowerDirs)
+        os.rename(tmpPath, layerPath)
+        self.logger.debug("Saved dependency layer " + layerPath)
+
+    @staticmethod
+    def _writeCacheInfo(path, contentPath, lowerDirs):
+        size = 0
+        for root, dirs, files in os.walk(contentPath):
+            for name in dirs + files:
+                size += os.lstat(os.path.join(root, name)).st_size
+        with open(path + ".json", 'w') as infoFile:
+            json.dump({"lowerDirs": lowerDirs, "size": size}, infoFile)
+
+    # Returns lower directories to mount for the layer, or None if the
+    # layer or any layer below it is not available
+    @staticmethod
+    def _getLayerLowerDirs(layerPath):
+        if not os.path.isdir(layerPath) or not os.path.isfile(layerPath + ".json"):
+            return None
+        with open(layerPath + ".json", 'r') as infoFile:
+            lowerDirs = json.load(infoFile)["lowerDirs"]
+        for lowerDir in lowerDirs:
+            if not os.path.isdir(lowerDir):
+                return None
+        return lowerDirs
+
+    # Removes least recently used snapshots and layers which are neither
+    # mounted nor locked until the cache fits constants.layerCacheSize.
+    # Must be called with the layer directory lock held.
+    @staticmethod
+    def _evictLayers():
+        entries = []
+        for dirName in [SnapshotChroot.snapshotDirName, SnapshotChroot.layerDirName]:
+            cacheDir = os.path.join(constants.buildRootPath, dirName)
+            if not os.path.isdir(cacheDir):
+                continue
+            for entry in os.scandir(cacheDir):
+                if not entry.is_dir() or not os.path.isfile(entry.path + ".json"):
+                    continue
+                with open(entry.path + ".json", 'r') as infoFile:
+                    size = json.load(infoFile)["size"]
+                entries.append((entry.stat().st_mtime, entry.path, size))
+
+        totalSize = sum(size for _, _, size in entries)
+        cacheSize = int(constants.layerCacheSize * 1024 * 1024 * 1024)
+        if totalSize <= cacheSize:
+            return
+        with open("/proc/mounts", 'r') as mountsFile:
+            mounts = mountsFile.read()
+        for _, path, size in sorted(entries):
+            if totalSize <= cacheSize:
+                break
+            if path in mounts:
+                continue
+            entryLock = _CacheLock(path)
+            if not entryLock.acquire(blocking=False):
+                continue
+            try:
+                CommandUtils.runCommandInShell("rm -rf " + path)
+                os.remove(path + ".json")
+            finally:
+                entryLock.release()
+            totalSize -= size
+
+    def _mountOverlay(self, lowerDirs):
+        upperDir = self.chrootID + ".overlay/upper"
+        workDir = self.chrootID + ".overlay/work"
+        os.makedirs(upperDir)
+        os.makedirs(workDir)
+        cmd = ("mount -t overlay overlay -o lowerdir=" + ":".join(lowerDirs) + ",upperdir=" +
+               upperDir + ",workdir=" + workDir + " " + self.chrootID)
+        if CommandUtils.runCommandInShell(cmd, logfn=self.logger.debug) != 0:
+            self._removeChroot(self.chrootID + ".overlay")
+            return False
+        self.lowerDirs = lowerDirs
+        return True
+
+    # Replaces the upper layer of the chroot by given lower directories
+    def _remountOverlay(self, lowerDirs):
+        self._unmountAll(self.chrootID)
+        self._umount(self.chrootID)
+        self._removeChroot(self.chrootID + ".overlay")
+        if not self._mountOverlay(lowerDirs):
+            raise Exception("Unable to mount dependency layer " + lowerDirs[0])
+        self._prepareChroot(self.chrootID)
+
+    def _copySnapshot(self, snapshotPath, destPath):
+        cmd = "cp -a --reflink=auto " + snapshotPath + "/. " + destPath
+        if CommandUtils.runCommandInShell(cmd, logfn=self.logger.debug) != 0:
+            raise Exception("Unable to copy " + snapshotPath)
+
+    def _umount(self, mountpoint):
+        cmd = "umount " + mountpoint
+        process = subprocess.Popen("%s" %cmd, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        retval = process.wait()
+        if retval != 0:
+            raise Exception("Unable to unmount " + mountpoint)
+
+
+# Exclusive or shared lock of a cache entry, shared by threads and
+# processes
+class _CacheLock(object):
+
+    def __init__(self, path, shared=False):
+        self.lockPath = path + ".lock"
+        self.lockFile = None
+        self.operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+    # Returns False if blocking is False and the lock is held
+    def acquire(self, blocking=True):
+        self.lockFile = open(self.lockPath, 'w')
+        try:
+            fcntl.flock(self.lockFile, self.operation | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            self.lockFile.close()
+            self.lockFile = None
+            return False
+        return True
+
+    def release(self):
+        fcntl.flock(self.lockFile, fcntl.LOCK_UN)
+        self.lockFile.close()
+        self.lockFile = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.release()
+
+
+# Chroot living in private user, mount and pid namespaces, which needs
+# neither root nor a Docker daemon. The build root is a plain directory;
+# every command enters new namespaces through unshare(1) as mapped root,
+# mounts the kernel file systems and build directories there and chroots
+# into the build root. The mounts disappear together with the command,
+# so nothing is left mounted on the host even when the builder is
+# killed. Subordinate ids of the user from /etc/subuid are mapped too,
+# so that RPMs owning files of other users install. Without them, only
+# root is mapped.
+class UserNamespaceChroot(Chroot):
+
+    subIDFiles = {"users": "/etc/subuid", "groups": "/etc/subgid"}
+    lock = threading.Lock()
+    # Options of unshare(1) entering the namespaces, initialized on
+    # first use
+    unshareCmd = None
+    # Whether overlays can be mounted in a user namespace, initialized on
+    # first use
+    overlaySupported = None
+
+    def __init__(self, logger):
+        Chroot.__init__(self, logger)
+        self.runInChrootCommand = UserNamespaceChroot._getUnshareCommand() + " ./run-in-namespace.sh"
+
+    def create(self, chrootName):
+        Chroot.create(self, chrootName)
+        self._setCmdPrefix()
+
+    def _setCmdPrefix(self):
+        # the overlays of file farms are mounted by every command
+        fileFarms = " ".join(":".join([self._getFileFarmDir("lower", d),
+                                       self._getFileFarmDir("upper", d),
+                                       self._getFileFarmDir("work", d), d])
+                             for d in sorted(self.fileFarmDirs))
+        self.chrootCmdPrefix = " ".join(["FILE_FARMS='" + fileFarms + "'",
+                                         self.runInChrootCommand,
+                                         constants.rpmPath,
+                                         constants.sourceRpmPath,
+                                         constants.prevPublishRPMRepo,
+                                         constants.prevPublishXRPMRepo,
+                                         "'" + (constants.inputRPMSPath or "") + "'",
+                                         self.chrootID, ""])
+
+    def runOnHost(self, cmd, logfn=None):
+        return CommandUtils.runCommandInShell(UserNamespaceChroot._getUnshareCommand() + " " +
+                                              cmd, logfn=logfn)
+
+    # Mounts are made by every command, in its own namespace
+    def _prepareChroot(self, chrootID):
+        self._createBuildRootDirs(chrootID)
+        shutil.copy("/etc/resolv.conf", chrootID + "/etc/")
+        self.logger.debug("Successfully created chroot:" + chrootID)
+
+    def _unmountAll(self, chrootID):
+        pass
+
+    def _canMountFileFarm(self):
+        return UserNamespaceChroot._canMountOverlay()
+
+    def _mountFileFarm(self, dest):
+        self.fileFarmDirs.add(dest)
+        self._setCmdPrefix()
+        return True
+
+    # The overlay is only mounted while a command runs, so files can be
+    # added to the lower directory in between
+    def _addToFileFarm(self, files, dest):
+        self._linkFiles(files, self._getFileFarmDir("lower", dest), hardlink=True)
+
+    # Mounting overlays in a user namespace needs Linux 5.11 or newer
+    @staticmethod
+    def _canMountOverlay():
+        with UserNamespaceChroot.lock:
+            if UserNamespaceChroot.overlaySupported is None:
+                with tempfile.TemporaryDirectory() as tempDir:
+                    for d in ["lower", "upper", "work", "merged"]:
+                        os.mkdir(os.path.join(tempDir, d))
+                    cmd = ("unshare --map-root-user --mount mount -t overlay overlay -o " +
+                           "lowerdir={0}/lower,upperdir={0}/upper,workdir={0}/work " +
+                           "{0}/merged").format(tempDir)
+                    UserNamespaceChroot.overlaySupported = (
+                        CommandUtils.runCommandInShell(cmd, logfn=lambda _: None) == 0)
+            return UserNamespaceChroot.overlaySupported
+
+    # Files of mapped users other than root can only be removed from
+    # inside the user namespace
+    def _removeChroot(self, chrootPath):
+        if self.runOnHost("rm -rf " + chrootPath, logfn=self.logger.debug) != 0:
+            raise Exception("Unable to remove files from chroot " + chrootPath)
+
+    @staticmethod
+    def _getUnshareCommand():
+        if UserNamespaceChroot.unshareCmd is None:
+            cmd = "unshare --map-root-user --mount --pid --fork --kill-child --mount-proc"
+            for idType, subIDFile in UserNamespaceChroot.subIDFiles.items():
+                subIDRange = UserNamespaceChroot._getSubIDRange(subIDFile)
+                if subIDRange is not None:
+                    cmd += " --map-%s=%d,1,%d" % ((idType,) + subIDRange)
+            UserNamespaceChroot.unshareCmd = cmd
+        return UserNamespaceChroot.unshareCmd
+
+    # Returns (first id, number of ids) of the first subordinate id range
+    # of the user
+    @staticmethod
+    def _getSubIDRange(subIDFile):
+        if not os.path.isfile(subIDFile) or shutil.which("newuidmap") is None:
+            return None
+        names = [str(os.getuid())]
+        try:
+            names.append(pwd.getpwuid(os.getuid()).pw_name)
+        except KeyError:
+            pass
+        with open(subIDFile, 'r') as f:
+            for line in f:
+                fields = line.strip().split(":")
+                if len(fields) == 3 and fields[0] in names:
+                    return int(fields[1]), int(fields[2])
+        return None
+
+
+# Build containers are long-lived: once a package is built, the container
+# is reset to the RPMs it started with, its build directories and /tmp
+# are emptied, and it is kept for the next package if docker diff shows
+# no other change than those. Containers which can not be reset to that
+# state are removed. All containers share one Docker client.
 class Container(Sandbox):
+
+    lock = threading.Lock()
+    dockerClient = None
+    # (container, RPMs installed when it started, docker diff when it
+    # started) of containers ready for the next package
+    idleContainers = []
+    # Directories of the build, emptied when the container is reset
+    buildDirs = ["BUILD", "BUILDROOT", "SOURCES", "SPECS", "LOGS"]
+    # Changes of the container file system which are undone by the reset
+    # (the RPM database and the ld.so cache are derived from the installed
+    # RPMs, which are verified instead)
+    resetPaths = ["/tmp", "/var/lib/rpm", "/etc/ld.so.cache", "/var/cache/ldconfig"]
+
     def __init__(self, logger):
         Sandbox.__init__(self, logger)
         self.containerID = None
-        self.dockerClient = docker.from_env(version="auto")
+        self.baselineRPMs = None
+        self.baselineChanges = None
+        self.dockerClient = Container.getDockerClient()
+
+    @staticmethod
+    def getDockerClient():
+        with Container.lock:
+            if Container.dockerClient is None:
+                # every build thread may talk to Docker at the same time
+                Container.dockerClient = docker.from_env(
+                    version="auto", max_pool_size=max(10, constants.buildThreads * 2))
+            return Container.dockerClient
+
+    # Drops the Docker client and the idle containers of the parent in a
+    # forked process, whose connections must not be shared
+    @staticmethod
+    def clearDockerClient():
+        Container.dockerClient = None
+        Container.idleContainers = []
+
+    # Removes containers kept for later builds
+    @staticmethod
+    def removeIdleContainers():
+        with Container.lock:
+            idleContainers = Container.idleContainers
+            Container.idleContainers = []
+        for containerID, _, _ in idleContainers:
+            Container._removeContainer(containerID)
+
+    @staticmethod
+    def _removeContainer(containerID):
+        containerID.remove(force=True)
+        shutil.rmtree(Container._getTmpDir(containerID.name), ignore_errors=True)
+
+    # Every container has its own /tmp, emptied when it is reset
+    @staticmethod
+    def _getTmpDir(containerName):
+        return os.path.join(constants.tmpDirPath, "container-" + containerName)
 
     def getID(self):
         return self.containerID.short_id
 
     def create(self, containerName):
+        with Container.lock:
+            if Container.idleContainers:
+                self.containerID, self.baselineRPMs, self.baselineChanges = (
+                    Container.idleContainers.pop())
+        if self.containerID is not None:
+            self.logger.debug("Reusing container:" + self.containerID.short_id)
+            return
+
         containerID = None
+        containerName = containerName.replace("+", "p")
+        tmpDir = Container._getTmpDir(containerName)
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        os.makedirs(tmpDir)
         mountVols = {
             constants.prevPublishRPMRepo: {'bind': '/publishrpms', 'mode': 'ro'},
             constants.prevPublishXRPMRepo: {'bind': '/publishxrpms', 'mode': 'ro'},
-            constants.tmpDirPath: {'bind': '/tmp', 'mode': 'rw'},
+            tmpDir: {'bind': '/tmp', 'mode': 'rw'},
             constants.rpmPath: {'bind': constants.topDirPath + "/RPMS", 'mode': 'rw'},
             constants.sourceRpmPath: {'bind': constants.topDirPath + "/SRPMS", 'mode': 'rw'},
 #            constants.logPath: {'bind': constants.topDirPath + "/LOGS", 'mode': 'rw'},
@@ -193,7 +769,6 @@ class Container(Sandbox):
         if constants.inputRPMSPath:
             mountVols[constants.inputRPMSPath] = {'bind': '/inputrpms', 'mode': 'ro'}
 
-        containerName = containerName.replace("+", "p")
         try:
             oldContainerID = self.dockerClient.containers.get(containerName)
             if oldContainerID is not None:
@@ -225,10 +800,84 @@ class Container(Sandbox):
                             containerTaskName)
         self.logger.debug("Successfully created container:" + containerID.short_id)
         self.containerID = containerID
+        self.baselineRPMs = self._getInstalledRPMs()
+        self.baselineChanges = self._getChanges()
 
     def destroy(self):
-        self.containerID.remove(force=True)
+        if self._reset():
+            with Container.lock:
+                Container.idleContainers.append((self.containerID, self.baselineRPMs,
+                                                 self.baselineChanges))
+        else:
+            Container._removeContainer(self.containerID)
         self.containerID = None
+        self.baselineRPMs = None
+        self.baselineChanges = None
+
+    # Erases RPMs installed for the build and empties build directories
+    # and /tmp. Returns False if anything else of the container changed.
+    def _reset(self):
+        try:
+            installedRPMs = self._getInstalledRPMs()
+            addedRPMs = installedRPMs - self.baselineRPMs
+            if addedRPMs:
+                if self.run("rpm -e --nodeps " + " ".join(sorted(addedRPMs)),
+                            logfn=self.logger.debug) != 0:
+                    return False
+                installedRPMs = self._getInstalledRPMs()
+            if installedRPMs != self.baselineRPMs:
+                self.logger.debug("RPMs of container " + self.getID() + " changed, removing it")
+                return False
+            buildDirs = " ".join(constants.topDirPath + "/" + d for d in Container.buildDirs)
+            result = self.containerID.exec_run(["/bin/sh", "-c",
+                                                "rm -rf " + buildDirs + " && mkdir -p " +
+                                                buildDirs + " && find /tmp -mindepth 1 -delete"])
+            if result.exit_code != 0:
+                return False
+            changedFiles = self._getChangedFiles()
+            if changedFiles:
+                self.logger.debug("Files of container " + self.getID() + " changed, removing it: " +
+                                  " ".join(changedFiles))
+                return False
+            return True
+        except docker.errors.APIError as e:
+            self.logger.debug("Unable to reset container " + self.getID() + ": " + str(e))
+            return False
+
+    # Returns set of (path, kind) of docker diff
+    def _getChanges(self):
+        return set((change["Path"], change["Kind"]) for change in self.containerID.diff() or [])
+
+    # Returns paths changed since the container started, apart from the
+    # build directories, resetPaths and directories whose entries are
+    # unchanged (only their metadata is)
+    def _getChangedFiles(self):
+        resetPaths = ([constants.topDirPath + "/" + d for d in Container.buildDirs] +
+                      Container.resetPaths)
+        changedPaths = []
+        for path, kind in sorted(self._getChanges() - self.baselineChanges):
+            if any(path == p or path.startswith(p + "/") for p in resetPaths):
+                continue
+            if any(p.startswith(path + "/") for p in resetPaths):
+                continue
+            changedPaths.append((path, kind))
+        # kind 0 is a modified path, 1 an added and 2 a deleted one
+        modifiedPaths = [path for path, kind in changedPaths if kind == 0]
+        modifiedDirs = set()
+        if modifiedPaths:
+            result = self.containerID.exec_run(
+                ["/bin/sh", "-c", 'for p; do [ -d "$p" ] && echo "$p"; done; true', "sh"] +
+                modifiedPaths)
+            modifiedDirs = set(result.output.decode().split("\n"))
+        return [path for path, kind in changedPaths
+                if kind != 0 or path not in modifiedDirs]
+
+    def _getInstalledRPMs(self):
+        result = self.containerID.exec_run(["rpm", "-qa", "--qf",
+                                            "%{NAME}-%{VERSION}-%{RELEASE}.%{ARCH}\\n"])
+        if result.exit_code != 0:
+            raise Exception("Unable to query RPMs of container " + self.getID())
+        return set(result.output.decode().split())
 
     def run(self, cmd, logfile=None, logfn=None):
         result = self.containerID.exec_run(cmd)
@@ -241,9 +890,31 @@ class Container(Sandbox):
                     f.flush()
         return result.exit_code
 
+    # Like docker cp, dest is the directory to put src in if it is one,
+    # otherwise the path of the copy
     def put(self, src, dest):
-        copyCmd = "docker cp " + src + " " + self.containerID.short_id + ":" + dest
-        CommandUtils.runCommandInShell(copyCmd)
+        if dest.endswith("/") or self._isDirectory(dest):
+            self.putFiles([src], dest)
+        else:
+            self._putArchive([(src, os.path.basename(dest))], os.path.dirname(dest))
+
+    def _isDirectory(self, path):
+        return self.containerID.exec_run(["test", "-d", path]).exit_code == 0
+
+    # All files go in a single tar stream instead of a docker cp per file
+    def putFiles(self, files, dest):
+        if files:
+            self._putArchive([(f, os.path.basename(f)) for f in files], dest)
+
+    def _putArchive(self, files, destDir):
+        with tempfile.TemporaryFile() as archive:
+            with tarfile.open(fileobj=archive, mode="w") as tar:
+                for src, name in files:
+                    tar.add(src, arcname=name)
+            archive.seek(0)
+            if not self.containerID.put_archive(destDir, archive):
+                raise Exception("Unable to put files to " + destDir + " of container " +
+                                self.getID())
 
     def hasToolchain(self):
         return True
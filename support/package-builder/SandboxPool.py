@@ -0,0 +1,153 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Takes sandbox setup and teardown off the path of the build workers. A
+# preparer thread keeps created sandboxes ready for the packages waiting
+# in the Scheduler ready queue, and a destroyer thread deletes sandboxes
+# of finished builds, so that neither creating a sandbox nor removing a
+# large build tree delays the next build of a worker.
+#
+# Sandboxes are only prepared empty: the toolchain RPMs installed into a
+# sandbox depend on the package built in it.
+
+import threading
+from queue import Queue
+from Sandbox import Chroot, SnapshotChroot, UserNamespaceChroot, Container
+from Scheduler import Scheduler
+
+class SandboxPool(object):
+
+    lock = threading.Lock()
+    # Signalled whenever the pool changes or has to stop
+    condition = threading.Condition(lock)
+    sandboxType = "chroot"
+    maxSandboxes = 0
+    logger = None
+    readySandboxes = []
+    numSandboxesCreated = 0
+    sandboxesToDestroy = Queue()
+    preparerThread = None
+    destroyerThread = None
+    stopPreparing = True
+
+    @staticmethod
+    def createSandbox(sandboxType, logger):
+        if sandboxType == "chroot":
+            return Chroot(logger)
+        if sandboxType == "snapshot":
+            return SnapshotChroot(logger)
+        if sandboxType == "userns":
+            return UserNamespaceChroot(logger)
+        if sandboxType == "container":
+            return Container(logger)
+        raise Exception("Unknown sandbox type: " + sandboxType)
+
+    # Keeps up to maxSandboxes sandboxes of given type ready
+    @staticmethod
+    def start(sandboxType, maxSandboxes, logger):
+        SandboxPool.sandboxType = sandboxType
+        SandboxPool.maxSandboxes = maxSandboxes
+        SandboxPool.logger = logger
+        SandboxPool.readySandboxes = []
+        SandboxPool.sandboxesToDestroy = Queue()
+        SandboxPool.stopPreparing = False
+        SandboxPool.preparerThread = threading.Thread(target=SandboxPool._prepareSandboxes,
+                                                      name="SandboxPreparer")
+        SandboxPool.destroyerThread = threading.Thread(target=SandboxPool._destroySandboxes,
+                                                       name="SandboxDestroyer")
+        SandboxPool.preparerThread.start()
+        SandboxPool.destroyerThread.start()
+        Scheduler.setReadyQueueListener(SandboxPool.notifyReadyQueueChanged)
+
+    # Destroys unused sandboxes and waits for pending destroys
+    @staticmethod
+    def stop():
+        if SandboxPool.preparerThread is None:
+            return
+        Scheduler.setReadyQueueListener(None)
+        with SandboxPool.condition:
+            SandboxPool.stopPreparing = True
+            SandboxPool.condition.notify_all()
+        SandboxPool.preparerThread.join()
+        for sandbox in SandboxPool.readySandboxes:
+            SandboxPool.sandboxesToDestroy.put(sandbox)
+        SandboxPool.readySandboxes = []
+        SandboxPool.sandboxesToDestroy.put(None)
+        SandboxPool.destroyerThread.join()
+        SandboxPool.preparerThread = None
+        SandboxPool.destroyerThread = None
+
+    # Wakes the preparer up when packages become ready to build
+    @staticmethod
+    def notifyReadyQueueChanged():
+        with SandboxPool.condition:
+            SandboxPool.condition.notify_all()
+
+    @staticmethod
+    def isRunning():
+        return SandboxPool.preparerThread is not None
+
+    # Returns (sandbox, created). A sandbox of the pool is already
+    # created, otherwise the caller has to create it.
+    @staticmethod
+    def getSandbox(sandboxType, logger):
+        if SandboxPool.isRunning() and sandboxType == SandboxPool.sandboxType:
+            with SandboxPool.condition:
+                if SandboxPool.readySandboxes:
+                    sandbox = SandboxPool.readySandboxes.pop(0)
+                    SandboxPool.condition.notify_all()
+                    sandbox.logger = logger
+                    logger.debug("Using prepared sandbox " + sandbox.getID())
+                    return sandbox, True
+        return SandboxPool.createSandbox(sandboxType, logger), False
+
+    @staticmethod
+    def releaseSandbox(sandbox):
+        if SandboxPool.isRunning():
+            SandboxPool.sandboxesToDestroy.put(sandbox)
+        else:
+            sandbox.destroy()
+
+    # One sandbox for every package in the ready queue, up to one per
+    # worker
+    @staticmethod
+    def _getNumSandboxesNeeded():
+        return min(SandboxPool.maxSandboxes,
+                   Scheduler.listOfPackagesNextToBuild.qsize())
+
+    @staticmethod
+    def _prepareSandboxes():
+        while True:
+            with SandboxPool.condition:
+                while (not SandboxPool.stopPreparing and
+                       len(SandboxPool.readySandboxes) >= SandboxPool._getNumSandboxesNeeded()):
+                    SandboxPool.condition.wait()
+                if SandboxPool.stopPreparing:
+                    return
+                sandboxName = "sandbox-pool-" + str(SandboxPool.numSandboxesCreated)
+                SandboxPool.numSandboxesCreated += 1
+
+            sandbox = SandboxPool.createSandbox(SandboxPool.sandboxType, SandboxPool.logger)
+            try:
+                sandbox.create(sandboxName)
+            except Exception as e:
+                SandboxPool.logger.error("Unable to prepare sandbox " + sandboxName)
+                SandboxPool.logger.exception(e)
+                # workers create their sandboxes themselves from now on
+                with SandboxPool.condition:
+                    SandboxPool.stopPreparing = True
+                return
+
+            with SandboxPool.condition:
+                SandboxPool.readySandboxes.append(sandbox)
+
+    @staticmethod
+    def _destroySandboxes():
+        while True:
+            sandbox = SandboxPool.sandboxesToDestroy.get()
+            if sandbox is None:
+                return
+            try:
+                sandbox.destroy()
+            except Exception as e:
+                SandboxPool.logger.error("Unable to destroy sandbox " + str(sandbox.getID()))
+                SandboxPool.logger.exception(e)
@@ -1,11 +1,12 @@
 import threading
 from queue import PriorityQueue
 import json
-from ThreadPool import ThreadPool
 from constants import constants
 from Logger import Logger
 from SpecData import SPECS
 from StringUtils import StringUtils
+from SchedulingPolicy import SchedulingPolicy
+from BuildTrace import BuildTrace
 
 
 class DependencyGraphNode(object):
@@ -56,23 +57,39 @@ class DependencyGraphNode(object):
 class Scheduler(object):
 
     lock = threading.Lock()
+    # Signalled whenever a build finishes or scheduling stops, so that
+    # idle workers can look for new work.
+    condition = threading.Condition(lock)
     listOfAlreadyBuiltPackages = set()
-    listOfPackagesToBuild = []
+    listOfPackagesToBuild = set()
     listOfPackagesCurrentlyBuilding = set()
     sortedList = []
     listOfPackagesNextToBuild = PriorityQueue()
     listOfFailedPackages = []
+    listOfSkippedPackages = set()
     priorityMap = {}
     pkgWeights = {}
     logger = None
     event = None
+    # Called with Scheduler.lock held whenever a package is added to the
+    # ready queue
+    readyQueueListener = None
     stopScheduling = False
     mapPackagesToGraphNodes = {}
+    # Ready-set bookkeeping: number of required packages which are not
+    # built yet, and packages waiting for a given package to be built.
+    mapPackageToNumUnbuiltRequires = {}
+    mapPackageToWaitingPackages = {}
 
     @staticmethod
     def setEvent(event):
         Scheduler.event = event
 
+    @staticmethod
+    def setReadyQueueListener(listener):
+        with Scheduler.lock:
+            Scheduler.readyQueueListener = listener
+
     @staticmethod
     def setLog(logName, logPath, logLevel):
         Scheduler.logger = Logger.getLogger(logName, logPath, logLevel)
@@ -83,15 +100,17 @@ class Scheduler(object):
 
         Scheduler.listOfAlreadyBuiltPackages = listOfAlreadyBuiltPackages
 
+        Scheduler.listOfPackagesToBuild = set()
         for pkg in Scheduler.sortedList:
             pkgName, pkgVersion = StringUtils.splitPackageNameAndVersion(pkg)
             if (pkg not in Scheduler.listOfAlreadyBuiltPackages
                or pkgName in constants.testForceRPMS):
-                Scheduler.listOfPackagesToBuild.append(pkg)
+                Scheduler.listOfPackagesToBuild.add(pkg)
 
         Scheduler.listOfPackagesCurrentlyBuilding = set()
         Scheduler.listOfPackagesNextToBuild = PriorityQueue()
         Scheduler.listOfFailedPackages = []
+        Scheduler.listOfSkippedPackages = set()
 
         # When performing (only) make-check, package dependencies are
         # irrelevant; i.e., all the packages can be "make-checked" in
@@ -114,6 +133,10 @@ class Scheduler(object):
             # which builds the dependency graph.
             Scheduler._publishBuildDependencies()
 
+        # Must be called after _setPriorities() as well, since ready
+        # packages are queued by priority.
+        Scheduler._initReadyQueue()
+
 
     @staticmethod
     def notifyPackageBuildCompleted(package):
@@ -121,6 +144,9 @@ class Scheduler(object):
             if package in Scheduler.listOfPackagesCurrentlyBuilding:
                 Scheduler.listOfPackagesCurrentlyBuilding.remove(package)
                 Scheduler.listOfAlreadyBuiltPackages.add(package)
+                Scheduler._markRequiredPackageBuilt(package)
+                Scheduler._traceCounters()
+                Scheduler.condition.notify_all()
 
     @staticmethod
     def notifyPackageBuildFailed(package):
@@ -128,6 +154,16 @@ class Scheduler(object):
             if package in Scheduler.listOfPackagesCurrentlyBuilding:
                 Scheduler.listOfPackagesCurrentlyBuilding.remove(package)
                 Scheduler.listOfFailedPackages.append(package)
+                if constants.keepGoing:
+                    Scheduler._skipWaitingPackages(package)
+                Scheduler._traceCounters()
+                Scheduler.condition.notify_all()
+
+    @staticmethod
+    def stop():
+        with Scheduler.lock:
+            Scheduler.stopScheduling = True
+            Scheduler.condition.notify_all()
 
     @staticmethod
     def isAllPackagesBuilt():
@@ -151,26 +187,39 @@ class Scheduler(object):
                 if Scheduler.event is not None:
                     Scheduler.event.set()
 
-            if Scheduler.listOfPackagesNextToBuild.empty():
-                Scheduler._getListNextPackagesReadyToBuild()
-
             if Scheduler.listOfPackagesNextToBuild.empty():
                 return None
 
-            packageTup = Scheduler.listOfPackagesNextToBuild.get()
+            return Scheduler._getNextReadyPackage()
+
+    # Blocks until a package is ready to build. Returns None once
+    # scheduling is stopped or no more packages can become ready, i.e.
+    # nothing is queued and nothing is being built.
+    @staticmethod
+    def waitForNextPackageToBuild():
+        with Scheduler.condition:
+            while True:
+                if Scheduler.stopScheduling:
+                    return None
+
+                if not Scheduler.listOfPackagesNextToBuild.empty():
+                    return Scheduler._getNextReadyPackage()
 
-            package = packageTup[1]
-            if Scheduler.listOfPackagesNextToBuild.qsize() > 0:
-                ThreadPool.activateWorkerThreads(
-                    Scheduler.listOfPackagesNextToBuild.qsize())
-            Scheduler.listOfPackagesCurrentlyBuilding.add(package)
-            Scheduler.listOfPackagesToBuild.remove(package)
-            return package
+                if not Scheduler.listOfPackagesCurrentlyBuilding:
+                    if Scheduler.event is not None:
+                        Scheduler.event.set()
+                    return None
+
+                Scheduler.condition.wait()
 
     @staticmethod
     def getDoneList():
         return list(Scheduler.listOfAlreadyBuiltPackages)
 
+    @staticmethod
+    def getSkippedList():
+        return list(Scheduler.listOfSkippedPackages)
+
 
     @staticmethod
     def _publishBuildDependencies():
@@ -556,7 +605,7 @@ class Scheduler(object):
     @staticmethod
     def _getPriority(package):
         try:
-            return int(Scheduler.priorityMap[package])
+            return Scheduler.priorityMap[package]
         except KeyError:
             return 0
 
@@ -570,39 +619,94 @@ class Scheduler(object):
             Scheduler._parseWeights()
             Scheduler._buildGraph()
 
-            for package in Scheduler.sortedList:
-                pkgNode = Scheduler.mapPackagesToGraphNodes[package]
-                Scheduler.priorityMap[package] = pkgNode.criticalChainWeight
+            policy = SchedulingPolicy.getPolicy(constants.schedulingPolicy)
+            Scheduler.logger.debug("Using scheduling policy " + constants.schedulingPolicy)
+            Scheduler.priorityMap = policy.getPriorities(Scheduler.sortedList,
+                                                         Scheduler.mapPackagesToGraphNodes)
 
         Scheduler.logger.debug("set Priorities: Priority of all packages")
         Scheduler.logger.debug(Scheduler.priorityMap)
 
 
+    # Returns set of base packages which have to be built before given
+    # package: its build requires, install requires and the whole Requires
+    # tree of them.
     @staticmethod
-    def _getListNextPackagesReadyToBuild():
+    def _getRequiredBasePackages(pkg):
+        listRequiredSubPackages = set(SPECS.getData().getBuildRequiresForPkg(pkg) + \
+                                      SPECS.getData().getRequiresAllForPkg(pkg))
+
+        # extend to full Requires tree
+        for p in list(listRequiredSubPackages):
+            listRequiredSubPackages |= SPECS.getData().getRequiresAllTreeForPkg(p)
+
+        # convert subpackages to basepkg
+        listRequiredPackages = set()
+        for p in listRequiredSubPackages:
+            listRequiredPackages.add(SPECS.getData().getBasePkg(p))
+        return listRequiredPackages
+
+    # Count not yet built requires of every package to build and remember
+    # the reverse edges, so that a finished build only has to update its
+    # waiting packages instead of rescanning the whole backlog.
+    @staticmethod
+    def _initReadyQueue():
+        Scheduler.mapPackageToNumUnbuiltRequires = {}
+        Scheduler.mapPackageToWaitingPackages = {}
         for pkg in Scheduler.listOfPackagesToBuild:
-            if pkg in Scheduler.listOfPackagesCurrentlyBuilding:
-                continue
-            listRequiredSubPackages = list(set(SPECS.getData().getBuildRequiresForPkg(pkg) + \
-                                   SPECS.getData().getRequiresAllForPkg(pkg)))
-
-            # extend to full Requires tree
-            for p in listRequiredSubPackages:
-                reqs = SPECS.getData().getRequiresAllForPkg(p)
-                for r in reqs:
-                    if r not in listRequiredSubPackages:
-                        listRequiredSubPackages.append(r)
-
-            # convert subpackages to basepkg
-            listRequiredPackages = set()
-            for p in listRequiredSubPackages:
-                listRequiredPackages.add(SPECS.getData().getBasePkg(p))
-
-            canBuild = True
-            for reqPkg in listRequiredPackages:
+            numUnbuiltRequires = 0
+            for reqPkg in Scheduler._getRequiredBasePackages(pkg):
                 if reqPkg not in Scheduler.listOfAlreadyBuiltPackages:
-                    canBuild = False
-                    break
-            if canBuild:
-                Scheduler.listOfPackagesNextToBuild.put((-Scheduler._getPriority(pkg), pkg))
-                Scheduler.logger.debug("Adding " + pkg + " to the schedule list")
+                    Scheduler.mapPackageToWaitingPackages.setdefault(reqPkg, []).append(pkg)
+                    numUnbuiltRequires += 1
+            Scheduler.mapPackageToNumUnbuiltRequires[pkg] = numUnbuiltRequires
+            if numUnbuiltRequires == 0:
+                Scheduler._addPackageToReadyQueue(pkg)
+
+    # Must be called with Scheduler.lock held
+    @staticmethod
+    def _markRequiredPackageBuilt(package):
+        for pkg in Scheduler.mapPackageToWaitingPackages.pop(package, []):
+            Scheduler.mapPackageToNumUnbuiltRequires[pkg] -= 1
+            if (Scheduler.mapPackageToNumUnbuiltRequires[pkg] == 0 and
+                    pkg in Scheduler.listOfPackagesToBuild):
+                Scheduler._addPackageToReadyQueue(pkg)
+
+    # Packages (transitively) waiting for a failed package can never be
+    # built, so drop them from the packages to build.
+    # Must be called with Scheduler.lock held
+    @staticmethod
+    def _skipWaitingPackages(package):
+        packagesToSkip = Scheduler.mapPackageToWaitingPackages.pop(package, [])
+        while packagesToSkip:
+            pkg = packagesToSkip.pop()
+            if pkg not in Scheduler.listOfPackagesToBuild:
+                continue
+            Scheduler.listOfPackagesToBuild.remove(pkg)
+            Scheduler.listOfSkippedPackages.add(pkg)
+            Scheduler.logger.info("Skipping " + pkg + " since it requires failed package " +
+                                  package)
+            packagesToSkip.extend(Scheduler.mapPackageToWaitingPackages.pop(pkg, []))
+
+    # Must be called with Scheduler.lock held
+    @staticmethod
+    def _getNextReadyPackage():
+        package = Scheduler.listOfPackagesNextToBuild.get()[1]
+        Scheduler.listOfPackagesCurrentlyBuilding.add(package)
+        Scheduler.listOfPackagesToBuild.remove(package)
+        Scheduler._traceCounters()
+        return package
+
+    @staticmethod
+    def _addPackageToReadyQueue(pkg):
+        Scheduler.listOfPackagesNextToBuild.put((-Scheduler._getPriority(pkg), pkg))
+        Scheduler.logger.debug("Adding " + pkg + " to the schedule list")
+        Scheduler._traceCounters()
+        if Scheduler.readyQueueListener is not None:
+            Scheduler.readyQueueListener()
+
+    @staticmethod
+    def _traceCounters():
+        BuildTrace.counter("ready queue", {"packages": Scheduler.listOfPackagesNextToBuild.qsize()})
+        BuildTrace.counter("busy workers",
+                           {"workers": len(Scheduler.listOfPackagesCurrentlyBuilding)})
@@ -0,0 +1,166 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Scheduling policies decide in which order the Scheduler hands out ready
+# packages. A policy turns the optimized dependency graph built by the
+# Scheduler into a priority per package; ready packages with higher
+# priority are built first.
+#
+# New policies are added by subclassing SchedulingPolicy and decorating
+# the class with @SchedulingPolicy.register. A policy living in another
+# module can also be selected as "module.ClassName".
+
+import importlib
+from SpecData import SPECS
+
+
+class SchedulingPolicy(object):
+
+    name = None
+    description = ""
+    policies = {}
+
+    @staticmethod
+    def register(policyClass):
+        SchedulingPolicy.policies[policyClass.name] = policyClass
+        return policyClass
+
+    @staticmethod
+    def getPolicy(policyName):
+        if policyName in SchedulingPolicy.policies:
+            return SchedulingPolicy.policies[policyName]()
+        if "." in policyName:
+            moduleName, className = policyName.rsplit(".", 1)
+            policyClass = getattr(importlib.import_module(moduleName), className)
+            return policyClass()
+        raise Exception("Unknown scheduling policy " + policyName + ". Available policies: " +
+                        ", ".join(sorted(SchedulingPolicy.policies)))
+
+    # Returns map of package to priority. mapPackagesToGraphNodes holds
+    # DependencyGraphNodes of the optimized graph: childPkgNodes have to be
+    # built before the package, parentPkgNodes wait for it.
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        raise NotImplementedError()
+
+    # Returns graph nodes ordered so that every node comes after all its
+    # parents.
+    @staticmethod
+    def _getNodesParentsFirst(sortedList, mapPackagesToGraphNodes):
+        numUnvisitedParents = {}
+        nodesToVisit = []
+        for package in sortedList:
+            pkgNode = mapPackagesToGraphNodes[package]
+            numUnvisitedParents[pkgNode] = len(pkgNode.parentPkgNodes)
+            if not pkgNode.parentPkgNodes:
+                nodesToVisit.append(pkgNode)
+
+        orderedNodes = []
+        while nodesToVisit:
+            pkgNode = nodesToVisit.pop()
+            orderedNodes.append(pkgNode)
+            for childPkgNode in pkgNode.childPkgNodes:
+                numUnvisitedParents[childPkgNode] -= 1
+                if numUnvisitedParents[childPkgNode] == 0:
+                    nodesToVisit.append(childPkgNode)
+        return orderedNodes
+
+    @staticmethod
+    def _getPackage(pkgNode):
+        return pkgNode.packageName + "-" + pkgNode.packageVersion
+
+
+@SchedulingPolicy.register
+class CriticalPathPolicy(SchedulingPolicy):
+
+    name = "critical-path"
+    description = "Longest chain of builds waiting for the package first"
+
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        return {package: mapPackagesToGraphNodes[package].criticalChainWeight
+                for package in sortedList}
+
+
+@SchedulingPolicy.register
+class LongestProcessingTimePolicy(SchedulingPolicy):
+
+    name = "lpt"
+    description = "Longest package build first"
+
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        return {package: mapPackagesToGraphNodes[package].selfWeight
+                for package in sortedList}
+
+
+@SchedulingPolicy.register
+class MostDependentsPolicy(SchedulingPolicy):
+
+    name = "most-dependents"
+    description = "Package unblocking most other packages first"
+
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        # Count all packages (transitively) waiting for the package.
+        # Critical chain weight breaks ties.
+        dependents = {}
+        maxChainWeight = 1
+        nodes = SchedulingPolicy._getNodesParentsFirst(sortedList, mapPackagesToGraphNodes)
+        for pkgNode in nodes:
+            dependents[pkgNode] = set()
+            for parentPkgNode in pkgNode.parentPkgNodes:
+                dependents[pkgNode].add(parentPkgNode)
+                dependents[pkgNode] |= dependents[parentPkgNode]
+            maxChainWeight = max(maxChainWeight, pkgNode.criticalChainWeight)
+
+        priorities = {}
+        for package in sortedList:
+            pkgNode = mapPackagesToGraphNodes[package]
+            priorities[package] = (len(dependents[pkgNode]) +
+                                   pkgNode.criticalChainWeight / (maxChainWeight + 1))
+        return priorities
+
+
+@SchedulingPolicy.register
+class HEFTPolicy(SchedulingPolicy):
+
+    name = "heft"
+    description = "Upward rank including dependency install cost (HEFT)"
+
+    # Cost of installing one required package into the sandbox, in
+    # package weight units. It plays the role of the communication cost
+    # of HEFT: a package can only start after its whole closure of
+    # required packages has been installed.
+    installCost = 0.1
+
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        # rank(package) = cost(package) + max(rank(parents)), where cost is
+        # the package weight plus the cost of installing its requires.
+        ranks = {}
+        nodes = SchedulingPolicy._getNodesParentsFirst(sortedList, mapPackagesToGraphNodes)
+        for pkgNode in nodes:
+            package = SchedulingPolicy._getPackage(pkgNode)
+            cost = pkgNode.selfWeight + self.installCost * self._getNumRequires(package)
+            ranks[pkgNode] = cost + max((ranks[p] for p in pkgNode.parentPkgNodes), default=0)
+        return {package: ranks[mapPackagesToGraphNodes[package]] for package in sortedList}
+
+    @staticmethod
+    def _getNumRequires(package):
+        requires = set(SPECS.getData().getBuildRequiresForPkg(package))
+        for pkg in list(requires):
+            requires |= SPECS.getData().getRequiresAllTreeForPkg(pkg)
+        return len(requires)
+
+
+@SchedulingPolicy.register
+class CriticalPathFanOutPolicy(SchedulingPolicy):
+
+    name = "critical-path-fanout"
+    description = "Critical path, boosted by number of packages waiting directly"
+
+    # Weight added for every package directly waiting for the package
+    fanOutWeight = 1
+
+    def getPriorities(self, sortedList, mapPackagesToGraphNodes):
+        priorities = {}
+        for package in sortedList:
+            pkgNode = mapPackagesToGraphNodes[package]
+            priorities[package] = (pkgNode.criticalChainWeight +
+                                   self.fanOutWeight * len(pkgNode.parentPkgNodes))
+        return priorities
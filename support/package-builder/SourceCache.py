@@ -0,0 +1,138 @@
+# pylint: disable=invalid-name,missing-docstring
+#
+# Content addressed store of the sources with sha1, so that builds don't
+# search the SOURCES directory with find and hash the found source again
+# for every package. A source is stored as <sha1[:2]>/<sha1>/<file name>
+# below the cache path, hardlinked to the file of the SOURCES directory
+# where possible. index.json maps "<file name> <sha1>" to the path, size
+# and mtime of the stored file. A source whose size and mtime match the
+# index is used without hashing it.
+#
+# The index is shared by concurrent builder runs: it is updated under an
+# exclusive flock, re-reading it first, and replaced atomically, so that
+# readers need no lock.
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+import PullSources
+from CommandUtils import CommandUtils
+from constants import constants
+
+class SourceCache(object):
+
+    lock = threading.Lock()
+    # map "<file name> <sha1>" to {"path", "size", "mtime"}
+    mapKeyToEntry = {}
+    # (inode, mtime) of the index file when it was read
+    indexStat = None
+    indexFileName = "index.json"
+
+    @staticmethod
+    def isEnabled():
+        return bool(constants.sourceCachePath)
+
+    # Returns path of a verified source, fetching it into the SOURCES
+    # directory from URLs first if needed. Returns None if the cache is
+    # disabled, then the source is only fetched.
+    @staticmethod
+    def fetch(package, source, sha1, URLs, logger):
+        if not SourceCache.isEnabled():
+            PullSources.get(package, source, sha1, constants.sourcePath, URLs, logger)
+            return None
+        sourcePath = SourceCache.getSourcePath(source, sha1, logger)
+        if sourcePath is None:
+            PullSources.get(package, source, sha1, constants.sourcePath, URLs, logger)
+            sourcePath = CommandUtils.findFile(source, constants.sourcePath)
+            if not sourcePath:
+                raise Exception("Missing source: " + source)
+            if len(sourcePath) > 1:
+                raise Exception("Multiple sources found for source:" + source + "\n" +
+                                ",".join(sourcePath) + "\nUnable to determine one.")
+            sourcePath = SourceCache._addSource(source, sha1, sourcePath[0])
+        return sourcePath
+
+    # Returns path of the source in the cache, or None
+    @staticmethod
+    def getSourcePath(source, sha1, logger):
+        key = source + " " + sha1
+        with SourceCache.lock:
+            SourceCache._loadIndex()
+            entry = SourceCache.mapKeyToEntry.get(key)
+        if entry is not None:
+            try:
+                fileStat = os.stat(entry["path"])
+            except OSError:
+                fileStat = None
+            if (fileStat is not None and fileStat.st_size == entry["size"] and
+                    fileStat.st_mtime_ns == entry["mtime"]):
+                return entry["path"]
+
+        # not indexed or changed since it was indexed
+        sourcePath = SourceCache._getObjectPath(source, sha1)
+        if not os.path.isfile(sourcePath):
+            return None
+        if PullSources.getFileHash(sourcePath) != sha1:
+            logger.info("sha1 of cached source " + sourcePath + " does not match, removing it")
+            os.remove(sourcePath)
+            return None
+        SourceCache._updateIndex(key, sourcePath)
+        return sourcePath
+
+    @staticmethod
+    def _getObjectPath(source, sha1):
+        return os.path.join(constants.sourceCachePath, sha1[:2], sha1, source)
+
+    # Stores a verified source file
+    @staticmethod
+    def _addSource(source, sha1, filePath):
+        sourcePath = SourceCache._getObjectPath(source, sha1)
+        os.makedirs(os.path.dirname(sourcePath), exist_ok=True)
+        tempPath = sourcePath + "-" + str(os.getpid()) + "-" + str(threading.get_ident())
+        try:
+            os.link(filePath, tempPath)
+        except OSError:
+            shutil.copy2(filePath, tempPath)
+        os.replace(tempPath, sourcePath)
+        SourceCache._updateIndex(source + " " + sha1, sourcePath)
+        return sourcePath
+
+    # Must be called with SourceCache.lock held
+    @staticmethod
+    def _loadIndex():
+        indexFile = os.path.join(constants.sourceCachePath, SourceCache.indexFileName)
+        try:
+            fileStat = os.stat(indexFile)
+        except OSError:
+            return
+        indexStat = (fileStat.st_ino, fileStat.st_mtime_ns)
+        if indexStat == SourceCache.indexStat:
+            return
+        try:
+            with open(indexFile, 'r') as f:
+                SourceCache.mapKeyToEntry = json.load(f)
+        except ValueError:
+            SourceCache.mapKeyToEntry = {}
+        SourceCache.indexStat = indexStat
+
+    @staticmethod
+    def _updateIndex(key, sourcePath):
+        fileStat = os.stat(sourcePath)
+        indexFile = os.path.join(constants.sourceCachePath, SourceCache.indexFileName)
+        os.makedirs(constants.sourceCachePath, exist_ok=True)
+        with SourceCache.lock:
+            with open(indexFile + ".lock", 'w') as lockFile:
+                fcntl.flock(lockFile, fcntl.LOCK_EX)
+                # entries added by other runs
+                SourceCache._loadIndex()
+                SourceCache.mapKeyToEntry[key] = {"path": sourcePath,
+                                                  "size": fileStat.st_size,
+                                                  "mtime": fileStat.st_mtime_ns}
+                tempFile = indexFile + "-" + str(os.getpid())
+                with open(tempFile, 'w') as f:
+                    json.dump(SourceCache.mapKeyToEntry, f, sort_keys=True)
+                os.replace(tempFile, indexFile)
+                fileStat = os.stat(indexFile)
+                SourceCache.indexStat = (fileStat.st_ino, fileStat.st_mtime_ns)
@@ -3,6 +3,9 @@ import platform
 import queue
 import json
 import operator
+import pickle
+import hashlib
+import multiprocessing
 from distutils.version import StrictVersion
 from Logger import Logger
 from constants import constants
@@ -11,8 +14,30 @@ from distutils.version import LooseVersion
 from SpecParser import SpecParser
 
 
+# Spec parser process initializer. Macros are passed explicitly, so the
+# pool does not depend on the process start method.
+def initSpecParser(userDefinedMacros, buildOptions):
+    constants.userDefinedMacros = userDefinedMacros
+    constants.buildOptions = buildOptions
+
+# Returns SpecObject for given spec file or None if the spec file
+# is not buildable for the current architecture.
+def parseSpecFile(specFile):
+    spec = SpecParser(specFile)
+
+    buildarch = spec.packages.get('default').buildarch
+    if (buildarch != "noarch" and
+            platform.machine() != buildarch):
+        return None
+
+    return spec.createSpecObject()
+
+
 class SpecData(object):
 
+    # Number of spec cache files (one per set of macros) to keep
+    maxSpecCacheFiles = 8
+
     def __init__(self, logPath, specFilesPath):
 
         self.logger = Logger.getLogger("SpecData", logPath, constants.logLevel)
@@ -29,24 +54,67 @@ class SpecData(object):
         # map spec file name to SpecObject
         self.mapSpecFileNameToSpecObj = {}
 
+        # Lookup indexes built once after parsing (see _buildIndexes):
+        # map subpackage name to the version-sorted list of SpecObjects
+        # and versions of its spec
+        self.mapPackageToSpecObjects = {}
+        self.mapPackageToVersions = {}
+        # map (subpackage name, version) to SpecObject
+        self.mapPackageVersionToSpecObj = {}
+
+        # Dependency resolution never changes within a run, so it is
+        # memoized (see _getResolvedRequires):
+        # map (package, compare, version) of dependentPackageData to
+        # "name-version" string
+        self.mapDependencyToPkg = {}
+        # map (requires type, package, version) to tuple of "name-version"
+        self.mapRequiresToPkgs = {}
+        # map requires type to map of "name-version" to frozenset of all
+        # "name-version" packages it transitively requires
+        self.mapRequiresTreeToPkgs = {}
+
         self._readSpecs(specFilesPath)
+        self._buildIndexes()
 
 
     # Read all .spec files from the given folder including subfolders,
     # creates corresponding SpecObjects and put them in internal mappings.
+    # Specs which did not change since the previous run (same content and
+    # same set of macros) are taken from the spec cache instead of being
+    # parsed again.
     def _readSpecs(self, specFilesPath):
-        for specFile in self._getListSpecFiles(specFilesPath):
-            spec = SpecParser(specFile)
+        macrosKey = self._getMacrosKey()
+        specCache = self._loadSpecCache(macrosKey)
+        newSpecCache = {}
+        listSpecFiles = self._getListSpecFiles(specFilesPath)
+        listSpecFilesToParse = []
+        for specFile in listSpecFiles:
+            specKey = self._getSpecKey(specFile)
+            if specFile in specCache and specCache[specFile][0] == specKey:
+                newSpecCache[specFile] = specCache[specFile]
+            else:
+                newSpecCache[specFile] = (specKey, None)
+                listSpecFilesToParse.append(specFile)
+
+        for specFile, specObj in zip(listSpecFilesToParse,
+                                     self._parseSpecFiles(listSpecFilesToParse)):
+            newSpecCache[specFile] = (newSpecCache[specFile][0], specObj)
+
+        self.logger.debug("Parsed " + str(len(listSpecFilesToParse)) + " of " +
+                          str(len(listSpecFiles)) + " spec files")
+        if listSpecFilesToParse or len(newSpecCache) != len(specCache):
+            self._saveSpecCache(macrosKey, newSpecCache)
+
+        # Merge in the order of spec files, so the result does not depend
+        # on how the spec files were parsed.
+        for specFile in listSpecFiles:
+            specObj = newSpecCache[specFile][1]
 
             # skip the specfile if buildarch differs
-            buildarch = spec.packages.get('default').buildarch
-            if (buildarch != "noarch" and
-                    platform.machine() != buildarch):
+            if specObj is None:
                 self.logger.info("skipping spec file: "+str(specFile))
                 continue
 
-            specObj = spec.createSpecObject()
-
             name = specObj.name
             for specPkg in specObj.listPackages:
                 self.mapPackageToSpec[specPkg] = name
@@ -58,7 +126,6 @@ class SpecData(object):
 
             self.mapSpecFileNameToSpecObj[os.path.basename(specFile)]=specObj
 
-
         # Sort the multiversion list to make getHighestVersion happy
         for key, value in self.mapSpecObjects.items():
             if len(value) > 1:
@@ -66,6 +133,113 @@ class SpecData(object):
                                                   key=lambda x : self.compareVersions(x),
                                                   reverse=True)
 
+    # Returns list of SpecObjects (None for skipped spec files) in the
+    # order of given spec files. Spec files are independent of each
+    # other, so they are parsed by a pool of processes if build threads
+    # are configured.
+    def _parseSpecFiles(self, listSpecFiles):
+        numProcesses = min(constants.buildThreads, len(listSpecFiles))
+        if numProcesses <= 1:
+            return [parseSpecFile(specFile) for specFile in listSpecFiles]
+
+        self.logger.debug("Parsing spec files using " + str(numProcesses) + " processes")
+        with multiprocessing.Pool(processes=numProcesses,
+                                  initializer=initSpecParser,
+                                  initargs=(constants.userDefinedMacros,
+                                            constants.buildOptions)) as pool:
+            return pool.map(parseSpecFile, listSpecFiles,
+                            chunksize=max(1, len(listSpecFiles) // (numProcesses * 4)))
+
+    # Parsing result depends not only on spec file content but also on
+    # the macros defined by the build system, on the architecture and on
+    # the parser itself. All of them are folded into one key here.
+    @staticmethod
+    def _getMacrosKey():
+        sha1 = hashlib.sha1()
+        sha1.update(json.dumps([constants.userDefinedMacros,
+                                constants.buildOptions,
+                                platform.machine()], sort_keys=True).encode())
+        parserDir = os.path.dirname(os.path.abspath(__file__))
+        for parserFile in ["SpecParser.py", "SpecStructures.py", "constants.py"]:
+            with open(os.path.join(parserDir, parserFile), 'rb') as f:
+                sha1.update(f.read())
+        return sha1.hexdigest()
+
+    @staticmethod
+    def _getSpecKey(specFile):
+        sha1 = hashlib.sha1()
+        with open(specFile, 'rb') as f:
+            sha1.update(f.read())
+        return sha1.hexdigest()
+
+    # Every set of macros has its own cache file, so builder.py, SpecDeps.py
+    # and GenerateOSSFiles.py (which define different macros) do not
+    # invalidate each other's cache. Cache file maps spec file path to
+    # (spec content key, SpecObject) tuple.
+    @staticmethod
+    def _getSpecCacheFile(macrosKey):
+        return os.path.join(constants.specCachePath, "specs-" + macrosKey + ".pickle")
+
+    def _loadSpecCache(self, macrosKey):
+        if not constants.specCachePath:
+            return {}
+        cacheFileName = self._getSpecCacheFile(macrosKey)
+        if not os.path.isfile(cacheFileName):
+            return {}
+        try:
+            with open(cacheFileName, 'rb') as cacheFile:
+                specCache = pickle.load(cacheFile)
+        except Exception as e:
+            self.logger.debug("Unable to load spec cache: " + str(e))
+            return {}
+        if not isinstance(specCache, dict):
+            return {}
+        # mark cache file as recently used
+        os.utime(cacheFileName)
+        return specCache
+
+    def _saveSpecCache(self, macrosKey, specCache):
+        if not constants.specCachePath:
+            return
+        cacheFileName = self._getSpecCacheFile(macrosKey)
+        # Several builder instances might run at the same time, so write
+        # to a temporary file first and then atomically replace the cache.
+        tempFile = cacheFileName + "-" + str(os.getpid())
+        try:
+            if not os.path.isdir(constants.specCachePath):
+                os.makedirs(constants.specCachePath)
+            with open(tempFile, 'wb') as cacheFile:
+                pickle.dump(specCache, cacheFile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tempFile, cacheFileName)
+            self._pruneSpecCache()
+        except Exception as e:
+            self.logger.debug("Unable to save spec cache: " + str(e))
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+
+    # Build number, dist tag, etc. are part of the macros, so keep only
+    # the most recently used cache files.
+    def _pruneSpecCache(self):
+        cacheFiles = []
+        for dirEntry in os.scandir(constants.specCachePath):
+            if dirEntry.name.startswith("specs-") and dirEntry.name.endswith(".pickle"):
+                cacheFiles.append((dirEntry.stat().st_mtime, dirEntry.path))
+        cacheFiles.sort(reverse=True)
+        for _, cacheFileName in cacheFiles[SpecData.maxSpecCacheFiles:]:
+            self.logger.debug("Removing old spec cache file: " + cacheFileName)
+            os.remove(cacheFileName)
+
+    # Accessors are called very often by the scheduler and builders, so
+    # resolve subpackage name and version to SpecObject in advance.
+    def _buildIndexes(self):
+        for package, specName in self.mapPackageToSpec.items():
+            specObjs = self.mapSpecObjects[specName]
+            self.mapPackageToSpecObjects[package] = specObjs
+            self.mapPackageToVersions[package] = [specObj.version for specObj in specObjs]
+            for specObj in specObjs:
+                # first SpecObject wins, like in linear search by version
+                self.mapPackageVersionToSpecObj.setdefault((package, specObj.version), specObj)
+
     def _getListSpecFiles(self, path):
         listSpecFiles = []
         for dirEntry in os.listdir(path):
@@ -114,74 +288,160 @@ class SpecData(object):
                          depPkg.compare + depPkg.version + \
                          " available specs:" + availableVersions)
 
-    def _getSpecObjField(self, package, version, field):
-        for specObj in self.getSpecObjects(package):
-            if specObj.version == version:
-                return field(specObj)
-        self.logger.error("Could not find " + package +
-                          "-" + version + " package from specs")
-        raise Exception("Invalid package: " + package + "-" + version)
+    def _getSpecObj(self, package, version):
+        specObj = self.mapPackageVersionToSpecObj.get((package, version))
+        if specObj is None:
+            self.logger.error("Could not find " + package +
+                              "-" + version + " package from specs")
+            raise Exception("Invalid package: " + package + "-" + version)
+        return specObj
+
+    # Returns "name-version" string of the package satisfying given
+    # dependentPackageData
+    def _getProperPkg(self, depPkg):
+        key = (depPkg.package, depPkg.compare, depPkg.version)
+        properPkg = self.mapDependencyToPkg.get(key)
+        if properPkg is None:
+            properPkg = depPkg.package + "-" + self._getProperVersion(depPkg)
+            self.mapDependencyToPkg[key] = properPkg
+        return properPkg
+
+    # Resolves given requires type of package-version to a tuple of
+    # "name-version" strings. Resolution is done lazily on first request,
+    # so unresolvable dependencies of packages which are never built do
+    # not fail the whole run.
+    def _getResolvedRequires(self, requiresType, package, version):
+        key = (requiresType, package, version)
+        resolvedRequires = self.mapRequiresToPkgs.get(key)
+        if resolvedRequires is not None:
+            return resolvedRequires
+
+        specObj = self._getSpecObj(package, version)
+        if requiresType == "build":
+            listDependentPackages = specObj.buildRequires
+        elif requiresType == "install":
+            listDependentPackages = specObj.installRequires
+        elif requiresType == "check":
+            listDependentPackages = specObj.checkBuildRequires
+        elif requiresType == "package":
+            listDependentPackages = specObj.installRequiresPackages.get(package, [])
+        else:
+            raise Exception("Invalid requires type: " + requiresType)
+
+        resolvedRequires = tuple(self._getProperPkg(depPkg)
+                                 for depPkg in listDependentPackages)
+        self.mapRequiresToPkgs[key] = resolvedRequires
+        return resolvedRequires
 
     def getBuildRequiresForPackage(self, package, version):
-        buildRequiresList=[]
-        for pkg in self._getSpecObjField(package, version, field=lambda x : x.buildRequires):
-            properVersion = self._getProperVersion(pkg)
-            buildRequiresList.append(pkg.package+"-"+properVersion)
-        return buildRequiresList
+        return self._getResolvedRequires("build", package, version)
 
     def getExtraBuildRequiresForPackage(self, package, version):
-        packages=[]
-        for pkg in self._getSpecObjField(package, version, field=lambda x : x.extraBuildRequires):
-            # no version deps for publishrpms - use just name
-            packages.append(pkg.package)
-        return packages
+        # no version deps for publishrpms - use just name
+        return tuple(pkg.package for pkg in self._getSpecObj(package, version).extraBuildRequires)
 
     def getBuildRequiresForPkg(self, pkg):
         package, version = StringUtils.splitPackageNameAndVersion(pkg)
         return self.getBuildRequiresForPackage(package, version)
 
-    # Returns list of [ "pkg1-vers1", "pkg2-vers2",.. ]
+    # Returns tuple of ( "pkg1-vers1", "pkg2-vers2",.. )
     def getRequiresAllForPackage(self, package, version):
-        requiresList=[]
-        for pkg in self._getSpecObjField(package, version, field=lambda x : x.installRequires):
-            properVersion = self._getProperVersion(pkg)
-            requiresList.append(pkg.package+"-"+properVersion)
-        return requiresList
+        return self._getResolvedRequires("install", package, version)
 
     def getRequiresAllForPkg(self, pkg):
         package, version = StringUtils.splitPackageNameAndVersion(pkg)
         return self.getRequiresAllForPackage(package, version)
 
     def getRequiresForPackage(self, package, version):
-        requiresList=[]
-        for specObj in self.getSpecObjects(package):
-            if specObj.version == version:
-                if package in specObj.installRequiresPackages:
-                    requiresPackages = specObj.installRequiresPackages[package]
-                    for pkg in requiresPackages:
-                        properVersion = self._getProperVersion(pkg)
-                        requiresList.append(pkg.package+"-"+properVersion)
-                return requiresList
-        self.logger.error("Could not find " + package +
-                          "-" + version + " package from specs")
-        raise Exception("Invalid package: " + package + "-" + version)
+        return self._getResolvedRequires("package", package, version)
 
     def getRequiresForPkg(self, pkg):
         package, version = StringUtils.splitPackageNameAndVersion(pkg)
         return self.getRequiresForPackage(package, version)
 
     def getCheckBuildRequiresForPackage(self, package, version):
-        checkBuildRequiresList=[]
-        checkBuildRequiresPackages = self._getSpecObjField(package, version, field=lambda x : x.checkBuildRequires)
-        for pkg in checkBuildRequiresPackages:
-            properVersion = self._getProperVersion(pkg)
-            checkBuildRequiresList.append(pkg.package+"-"+properVersion)
-        return checkBuildRequiresList
+        return self._getResolvedRequires("check", package, version)
+
+    # Returns frozenset of all "name-version" packages transitively
+    # required by given "name-version" package using requires type of
+    # _getResolvedRequires(). Package itself is a part of the result only
+    # if it is a part of a requires cycle.
+    #
+    # Closures are computed for all packages reachable from given one in
+    # a single pass: iterative Tarjan's algorithm finds strongly connected
+    # components (requires cycles) in reverse topological order, so by the
+    # time a component is completed closures of all packages it requires
+    # are already known, and all members of a component share one closure.
+    def _getRequiresTree(self, requiresType, pkg):
+        closures = self.mapRequiresTreeToPkgs.setdefault(requiresType, {})
+        if pkg in closures:
+            return closures[pkg]
+
+        def getRequires(p):
+            package, version = StringUtils.splitPackageNameAndVersion(p)
+            return self._getResolvedRequires(requiresType, package, version)
+
+        index = {pkg: 0}
+        lowlink = {pkg: 0}
+        stack = [pkg]
+        onStack = {pkg}
+        callStack = [(pkg, iter(getRequires(pkg)))]
+        while callStack:
+            node, children = callStack[-1]
+            for child in children:
+                if child in closures:
+                    continue
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    onStack.add(child)
+                    callStack.append((child, iter(getRequires(child))))
+                    break
+                if child in onStack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                callStack.pop()
+                if callStack:
+                    parent = callStack[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] != index[node]:
+                    continue
+                component = set()
+                while True:
+                    member = stack.pop()
+                    onStack.remove(member)
+                    component.add(member)
+                    if member == node:
+                        break
+                closure = set()
+                for member in component:
+                    for child in getRequires(member):
+                        closure.add(child)
+                        if child not in component:
+                            closure |= closures[child]
+                closure = frozenset(closure)
+                for member in component:
+                    closures[member] = closure
+        return closures[pkg]
+
+    # Returns frozenset of packages required by given "name-version" package
+    # and, recursively, by all of its requires, where every package means
+    # all subpackages of its spec (as getRequiresAllForPkg).
+    def getRequiresAllTreeForPkg(self, pkg):
+        return self._getRequiresTree("install", pkg)
+
+    # Same as above, but following Requires of exact subpackages
+    # (as getRequiresForPkg).
+    def getRequiresTreeForPkg(self, pkg):
+        return self._getRequiresTree("package", pkg)
 
     # Returns list of SpecObjects for given subpackage name
     def getSpecObjects(self, package):
-        specName=self.getSpecName(package)
-        return self.mapSpecObjects[specName]
+        specObjs = self.mapPackageToSpecObjects.get(package)
+        if specObjs is None:
+            self.logger.error("Could not find " + package + " package from specs")
+            raise Exception("Invalid package:" + package)
+        return specObjs
 
     def getPkgNamesFromObj(self, objlist):
         listPkgName=[]
@@ -190,35 +450,36 @@ class SpecData(object):
         return listPkgName
 
     def getRelease(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.release)
+        return self._getSpecObj(package, version).release
 
     def getVersions(self, package):
-        versions=[]
-        for specObj in self.getSpecObjects(package):
-            versions.append(specObj.version)
+        versions = self.mapPackageToVersions.get(package)
+        if versions is None:
+            self.logger.error("Could not find " + package + " package from specs")
+            raise Exception("Invalid package:" + package)
         return versions
 
     def getHighestVersion(self, package):
         return self.getSpecObjects(package)[0].version
 
     def getBuildArch(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.buildarch[package])
+        return self._getSpecObj(package, version).buildarch[package]
 
     def getSpecFile(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.specFile)
+        return self._getSpecObj(package, version).specFile
 
     def getPatches(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.listPatches)
+        return self._getSpecObj(package, version).listPatches
 
     def getSources(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.listSources)
+        return self._getSpecObj(package, version).listSources
 
     def getSHA1(self, package, version, source):
-        return self._getSpecObjField(package, version, field=lambda x : x.checksums.get(source))
+        return self._getSpecObj(package, version).checksums.get(source)
 
     # returns list of package names (no versions)
     def getPackages(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.listPackages)
+        return self._getSpecObj(package, version).listPackages
 
     def getPackagesForPkg(self, pkg):
         pkgs=[]
@@ -228,44 +489,39 @@ class SpecData(object):
         return pkgs
 
     def getRPMPackages(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.listRPMPackages)
+        return self._getSpecObj(package, version).listRPMPackages
 
     @staticmethod
     def compareVersions(p):
         return (StrictVersion(p.version))
 
     def getSpecName(self, package):
-        if package in self.mapPackageToSpec:
-            specName = self.mapPackageToSpec[package]
-            if specName in self.mapSpecObjects:
-                return specName
-        self.logger.error("Could not find " + package + " package from specs")
-        raise Exception("Invalid package:" + package)
+        specName = self.mapPackageToSpec.get(package)
+        if specName is None:
+            self.logger.error("Could not find " + package + " package from specs")
+            raise Exception("Invalid package:" + package)
+        return specName
 
     def isRPMPackage(self, package):
-        if package in self.mapPackageToSpec:
-            specName = self.mapPackageToSpec[package]
-            if specName in self.mapSpecObjects:
-                return True
-        return False
+        return package in self.mapPackageToSpec
 
     def getSecurityHardeningOption(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.securityHardening)
+        return self._getSpecObj(package, version).securityHardening
 
     def isCheckAvailable(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.isCheckAvailable)
+        return self._getSpecObj(package, version).isCheckAvailable
 
     def getListPackages(self):
         return list(self.mapSpecObjects.keys())
 
     def getURL(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.url)
+        return self._getSpecObj(package, version).url
 
     def getSourceURL(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.sourceurl)
+        return self._getSpecObj(package, version).sourceurl
 
     def getLicense(self, package, version):
-        return self._getSpecObjField(package, version, field=lambda x : x.license)
+        return self._getSpecObj(package, version).license
 
     # Converts "glibc-devel-2.28" into "glibc-2.28"
     def getBasePkg(self, pkg):
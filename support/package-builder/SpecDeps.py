@@ -50,7 +50,7 @@ class SpecDependencyGenerator(object):
 
     def getBasePackagesRequired(self, pkg):
         listBasePackagesRequired=[]
-        listPackagesRequired = SPECS.getData().getBuildRequiresForPkg(pkg)
+        listPackagesRequired = list(SPECS.getData().getBuildRequiresForPkg(pkg))
         listPackagesRequired.extend(SPECS.getData().getRequiresAllForPkg(pkg))
         for p in listPackagesRequired:
             basePkg = SPECS.getData().getBasePkg(p)
@@ -207,6 +207,7 @@ def main():
     constants.setSpecPath(options.spec_path)
     constants.setLogPath(options.log_path)
     constants.setLogLevel(options.log_level)
+    constants.setSpecCachePath(os.path.join(options.stage_dir, "spec-cache"))
     constants.initialize()
 
     cmdUtils = CommandUtils()
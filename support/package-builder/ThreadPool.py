@@ -3,8 +3,6 @@ import WorkerThread
 class ThreadPool(object):
 
     mapWorkerThreads = {}
-    activeWorkerThreads = []
-    inactiveWorkerThreads = []
     mapPackageToCycle = {}
     pkgBuildType = "chroot"
     logger = None
@@ -13,8 +11,6 @@ class ThreadPool(object):
     @staticmethod
     def clear():
         ThreadPool.mapWorkerThreads.clear()
-        ThreadPool.activeWorkerThreads = []
-        ThreadPool.inactiveWorkerThreads = []
 
     @staticmethod
     def addWorkerThread(workerThreadName):
@@ -26,36 +22,40 @@ class ThreadPool(object):
             ThreadPool.pkgBuildType)
         ThreadPool.mapWorkerThreads[workerThreadName] = workerThread
 
-    @staticmethod
-    def makeWorkerThreadActive(threadName):
-        if threadName in ThreadPool.inactiveWorkerThreads:
-            ThreadPool.inactiveWorkerThreads.remove(threadName)
-        ThreadPool.activeWorkerThreads.append(threadName)
-
-    @staticmethod
-    def makeWorkerThreadInActive(threadName):
-        if threadName in ThreadPool.activeWorkerThreads:
-            ThreadPool.activeWorkerThreads.remove(threadName)
-        ThreadPool.inactiveWorkerThreads.append(threadName)
-
     @staticmethod
     def startWorkerThread(threadName):
         ThreadPool.mapWorkerThreads[threadName].start()
 
+    # Workers live for the whole build: they wait in the Scheduler for
+    # ready packages and exit only when scheduling is over. Creating a
+    # worker forks its worker process, so all workers must be added
+    # before the coordinator starts any other thread, and started after.
     @staticmethod
-    def getListInactiveWorkerThreads():
-        return ThreadPool.inactiveWorkerThreads
+    def addWorkerThreads(numOfThreads):
+        for i in range(0, numOfThreads):
+            ThreadPool.addWorkerThread("WorkerThread" + str(i))
 
     @staticmethod
-    def activateWorkerThreads(numOfThreadsToActivate):
-        while ThreadPool.inactiveWorkerThreads and numOfThreadsToActivate > 0:
-            threadName = ThreadPool.inactiveWorkerThreads.pop()
-            ThreadPool.addWorkerThread(threadName)
-            ThreadPool.startWorkerThread(threadName)
-            ThreadPool.makeWorkerThreadActive(threadName)
-            numOfThreadsToActivate = numOfThreadsToActivate -1
+    def startWorkerThreads():
+        for workerName in ThreadPool.mapWorkerThreads:
+            ThreadPool.startWorkerThread(workerName)
 
     @staticmethod
     def join_all():
         for p in ThreadPool.mapWorkerThreads.values():
             p.join()
+
+    # Returns map of worker name to its statistics, in start order
+    @staticmethod
+    def getWorkerStats():
+        stats = {}
+        for name, workerThread in ThreadPool.mapWorkerThreads.items():
+            stats[name] = workerThread.getStats()
+        return stats
+
+    @staticmethod
+    def logWorkerStats():
+        for name, stats in ThreadPool.getWorkerStats().items():
+            ThreadPool.logger.info("%s: %d built, %d failed, busy %ds of %ds (%.1f%%)" %
+                                   (name, stats["built"], stats["failed"], stats["busyTime"],
+                                    stats["elapsedTime"], 100 * stats["utilization"]))
@@ -8,6 +8,7 @@ from PackageUtils import PackageUtils
 from constants import constants
 from SpecData import SPECS
 from StringUtils import StringUtils
+from RPMIndex import RPMIndex
 from Sandbox import Chroot, Container
 
 class ToolChainUtils(object):
@@ -26,19 +27,12 @@ class ToolChainUtils(object):
             self.rpmCommand = "fakeroot-ng rpm"
 
     def _findPublishedRPM(self, package, rpmdirPath):
-        listFoundRPMFiles = CommandUtils.findFile(package + "-*.rpm", rpmdirPath)
-        listFilterRPMFiles = []
-        for f in listFoundRPMFiles:
-            rpmFileName = os.path.basename(f)
-            checkRPMName = rpmFileName.replace(package, "")
-            rpmNameSplit = checkRPMName.split("-")
-            if len(rpmNameSplit) == 3:
-                listFilterRPMFiles.append(f)
-        if len(listFilterRPMFiles) == 1:
-            return listFilterRPMFiles[0]
-        if len(listFilterRPMFiles) == 0:
+        listFoundRPMFiles = RPMIndex.findRPMs(rpmdirPath, package)
+        if len(listFoundRPMFiles) == 1:
+            return listFoundRPMFiles[0]
+        if len(listFoundRPMFiles) == 0:
             return None
-        if len(listFilterRPMFiles) > 1:
+        if len(listFoundRPMFiles) > 1:
             self.logger.error("Found multiple rpm files for given package in rpm directory." +
                               "Unable to determine the rpm file for package:" + package)
             return None
@@ -91,13 +85,13 @@ class ToolChainUtils(object):
         return pkgCount
 
     def getListDependentPackages(self, package, version):
-        listBuildRequiresPkg=SPECS.getData().getBuildRequiresForPackage(package, version)
+        listBuildRequiresPkg=list(SPECS.getData().getBuildRequiresForPackage(package, version))
         listBuildRequiresPkg.extend(SPECS.getData().getCheckBuildRequiresForPackage(package, version))
         return listBuildRequiresPkg
 
     def installToolchainRPMS(self, chroot, packageName=None, packageVersion=None, usePublishedRPMS=True, availablePackages=None):
         self.logger.debug("Installing toolchain RPMS.......")
-        rpmFiles = ""
+        rpmFiles = []
         packages = ""
         listBuildRequiresPackages = []
         if packageName:
@@ -156,20 +150,23 @@ class ToolChainUtils(object):
                         continue
                     self.logger.error("Unable to find published rpm " + package)
                     raise Exception("Input Error")
-            rpmFiles += " " + rpmFile
+            rpmFiles.append(rpmFile)
             packages += " " + package+"-"+version
 
         self.logger.debug(packages)
+        chroot.installToolchain(rpmFiles, self._installToolchainRPMFiles)
+        self.logger.debug("Successfully installed default toolchain RPMS in Chroot:" + chroot.getID())
+        if packageName:
+            self.installExtraToolchainRPMS(chroot, packageName, packageVersion)
+
+    def _installToolchainRPMFiles(self, chroot, rpmFiles):
         cmd = (self.rpmCommand + " -i -v --nodeps --noorder --force --root " +
-               chroot.getID() +" --define \'_dbpath /var/lib/rpm\' "+ rpmFiles)
-        retVal = CommandUtils.runCommandInShell(cmd, logfn=self.logger.debug)
+               chroot.getID() +" --define \'_dbpath /var/lib/rpm\' "+ " ".join(rpmFiles))
+        retVal = chroot.runOnHost(cmd, logfn=self.logger.debug)
         if retVal != 0:
             self.logger.debug("Command Executed:" + cmd)
             self.logger.error("Installing toolchain RPMS failed")
             raise Exception("RPM installation failed")
-        self.logger.debug("Successfully installed default toolchain RPMS in Chroot:" + chroot.getID())
-        if packageName:
-            self.installExtraToolchainRPMS(chroot, packageName, packageVersion)
 
     def installExtraToolchainRPMS(self, sandbox, packageName, packageVersion):
         listOfToolChainPkgs = SPECS.getData().getExtraBuildRequiresForPackage(packageName, packageVersion)
@@ -179,6 +176,7 @@ class ToolChainUtils(object):
                          ": " + str(listOfToolChainPkgs))
         rpmFiles = ""
         packages = ""
+        hostRPMFiles = []
         for package in listOfToolChainPkgs:
             pkgUtils = PackageUtils(self.logName, self.logPath)
             if re.match("openjre*", packageName) is not None or re.match("openjdk*", packageName):
@@ -194,8 +192,13 @@ class ToolChainUtils(object):
                 raise Exception("Input Error")
             rpmFiles += " " + rpmFile.replace(path, sandboxPath)
             packages += " " + package
+            hostRPMFiles.append(rpmFile)
 
         self.logger.debug("Installing custom rpms:" + packages)
+        sandbox.installPackages(hostRPMFiles,
+                                lambda: self._installExtraToolchainRPMFiles(sandbox, rpmFiles))
+
+    def _installExtraToolchainRPMFiles(self, sandbox, rpmFiles):
         cmd = (self.rpmCommand + " -i -v --nodeps --noorder --force " + rpmFiles)
         retVal = sandbox.run(cmd, logfn=self.logger.debug)
         if retVal != 0:
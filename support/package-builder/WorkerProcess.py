@@ -0,0 +1,64 @@
+import multiprocessing
+from PackageBuilder import PackageBuilder
+from BuildTrace import BuildTrace
+from Sandbox import Container
+import PullSources
+
+# Builds packages in a separate process, so that log parsing, dependency
+# resolution and logging of concurrent builds don't contend for the GIL
+# of the coordinator. The process is forked, hence it works on a snapshot
+# of the SpecData and constants of the coordinator taken at fork time. The
+# Scheduler stays in the coordinator; the process only receives packages
+# to build over a pipe and answers with the build result.
+class WorkerProcess(object):
+
+    def __init__(self, name, mapPackageToCycle, pkgBuildType):
+        self.name = name
+        self.connection, childConnection = multiprocessing.Pipe()
+        context = multiprocessing.get_context("fork")
+        self.process = context.Process(target=_buildPackages, name=name,
+                                       args=(childConnection, mapPackageToCycle, pkgBuildType))
+        self.process.daemon = True
+        self.process.start()
+        childConnection.close()
+
+    def build(self, pkg, doneList):
+        try:
+            self.connection.send((pkg, doneList))
+            succeeded, message, traceEvents = self.connection.recv()
+        except (EOFError, OSError):
+            raise Exception("Worker process " + self.name + " died while building " + pkg)
+        BuildTrace.addEvents(traceEvents)
+        if not succeeded:
+            raise Exception(message)
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except (EOFError, OSError):
+            pass
+        self.connection.close()
+        self.process.join()
+
+
+def _buildPackages(connection, mapPackageToCycle, pkgBuildType):
+    # network and Docker clients of the coordinator are recreated here
+    PullSources.clearSession()
+    Container.clearDockerClient()
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        pkg, doneList = request
+        try:
+            pkgBuilder = PackageBuilder(mapPackageToCycle, pkgBuildType)
+            pkgBuilder.build(pkg, doneList)
+            connection.send((True, None, BuildTrace.popEvents()))
+        except Exception as e:
+            connection.send((False, "Failed to build " + pkg + ": " + str(e),
+                             BuildTrace.popEvents()))
+    Container.removeIdleContainers()
+    connection.close()
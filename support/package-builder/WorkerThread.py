@@ -1,7 +1,12 @@
 import threading
+import time
 from PackageBuilder import PackageBuilder
+from WorkerProcess import WorkerProcess
+from BuiltRPMIndex import BuiltRPMIndex
+from RepoData import RepoData
+from StringUtils import StringUtils
+from constants import constants
 import Scheduler
-import ThreadPool
 
 class WorkerThread(threading.Thread):
 
@@ -13,28 +18,78 @@ class WorkerThread(threading.Thread):
         self.mapPackageToCycle = mapPackageToCycle
         self.logger = logger
         self.pkgBuildType = pkgBuildType
+        self.startTime = None
+        self.stopTime = None
+        self.busyTime = 0
+        self.numPackagesBuilt = 0
+        self.numPackagesFailed = 0
+        self.workerProcess = None
+        if constants.workerType == "process":
+            self.workerProcess = WorkerProcess(name, mapPackageToCycle, pkgBuildType)
 
     def run(self):
-        buildThreadFailed = False
-        ThreadPool.ThreadPool.makeWorkerThreadActive(self.name)
+        self.startTime = time.time()
         self.logger.debug("Thread " + self.name + " is starting now")
         while True:
-            pkg = Scheduler.Scheduler.getNextPackageToBuild()
-            doneList = Scheduler.Scheduler.getDoneList()
+            pkg = Scheduler.Scheduler.waitForNextPackageToBuild()
             if pkg is None:
                 break
-            pkgBuilder = PackageBuilder(self.mapPackageToCycle,
-                                              self.pkgBuildType)
+            doneList = Scheduler.Scheduler.getDoneList()
+            buildStartTime = time.time()
             try:
-                pkgBuilder.build(pkg, doneList)
+                self._buildPackage(pkg, doneList)
             except Exception as e:
                 self.logger.exception(e)
-                buildThreadFailed = True
+                self.busyTime += time.time() - buildStartTime
+                self.numPackagesFailed += 1
                 Scheduler.Scheduler.notifyPackageBuildFailed(pkg)
+                if constants.keepGoing:
+                    self.logger.debug("Thread " + self.name + " failed to build package:" +
+                                      pkg + ", keep going")
+                    continue
                 self.logger.debug("Thread " + self.name + " stopped building package:" + pkg)
                 self.statusEvent.set()
                 break
+            self.busyTime += time.time() - buildStartTime
+            self.numPackagesBuilt += 1
+            self._indexBuiltRPMs(pkg)
             Scheduler.Scheduler.notifyPackageBuildCompleted(pkg)
 
-        ThreadPool.ThreadPool.makeWorkerThreadInActive(self.name)
+        if self.workerProcess is not None:
+            self.workerProcess.stop()
+        self.stopTime = time.time()
         self.logger.debug("Thread " + self.name + " is going to rest")
+
+    def _buildPackage(self, pkg, doneList):
+        if self.workerProcess is not None:
+            self.workerProcess.build(pkg, doneList)
+        else:
+            pkgBuilder = PackageBuilder(self.mapPackageToCycle,
+                                        self.pkgBuildType)
+            pkgBuilder.build(pkg, doneList)
+
+    # Done in this thread for both worker types, so that the index of the
+    # coordinator knows the RPMs built by worker processes
+    def _indexBuiltRPMs(self, pkg):
+        packageName, packageVersion = StringUtils.splitPackageNameAndVersion(pkg)
+        try:
+            # worker processes have RPM indexes of their own
+            BuiltRPMIndex.addBuiltFiles(packageName, packageVersion)
+            BuiltRPMIndex.addPackage(packageName, packageVersion)
+            RepoData.addPackage(packageName, packageVersion)
+        except Exception as e:
+            self.logger.error("Unable to index RPMs of " + pkg)
+            self.logger.exception(e)
+
+    def getStats(self):
+        elapsedTime = 0
+        if self.startTime is not None:
+            elapsedTime = (self.stopTime or time.time()) - self.startTime
+        utilization = 0
+        if elapsedTime > 0:
+            utilization = self.busyTime / elapsedTime
+        return {"built": self.numPackagesBuilt,
+                "failed": self.numPackagesFailed,
+                "busyTime": self.busyTime,
+                "elapsedTime": elapsedTime,
+                "utilization": utilization}
@@ -14,6 +14,10 @@ from constants import constants
 from PackageManager import PackageManager
 from SpecData import SPECS
 from PackageInfo import PackageInfo
+from BuildHistory import BuildHistory
+from BuildSimulator import BuildSimulator
+from SchedulingPolicy import SchedulingPolicy
+from BuildTrace import BuildTrace
 
 def main():
     parser = ArgumentParser()
@@ -55,9 +59,51 @@ def main():
                         default=False)
     parser.add_argument("-pw", "--package-weights-path", dest="packageWeightsPath",
                         default="../../common/data/packageWeights.json")
-    parser.add_argument("-bt", "--build-type", dest="pkgBuildType", choices=['chroot', 'container'], default="chroot")
+    parser.add_argument("-bt", "--build-type", dest="pkgBuildType", choices=['chroot', 'snapshot', 'userns', 'container'], default="chroot")
     parser.add_argument("-F", "--kat-build", dest="katBuild", default=None)
     parser.add_argument("-pj", "--packages-json-input", dest="pkgJsonInput", default=None)
+    parser.add_argument("-sc", "--spec-cache-path", dest="specCachePath",
+                        default="../../stage/spec-cache")
+    parser.add_argument("-scp", "--source-cache-path", dest="sourceCachePath",
+                        default="../../stage/source-cache")
+    parser.add_argument("-bh", "--build-history-path", dest="buildHistoryPath",
+                        default="../../stage/build-history.json")
+    parser.add_argument("-uw", "--update-package-weights", dest="updatePackageWeights",
+                        default=False, action="store_true",
+                        help="Regenerate package weights file from build history")
+    parser.add_argument("-sim", "--simulate", dest="simulate", default=None,
+                        choices=['weights', 'history', 'replay'],
+                        help="Simulate the build instead of running it, using package weights, "
+                             "estimates from build history or replaying the builds of a "
+                             "recorded run")
+    parser.add_argument("-rr", "--replay-run", dest="replayRun", default=None,
+                        help="Run ID of the build history replayed by --simulate replay, "
+                             "the latest run by default")
+    parser.add_argument("-sp", "--scheduling-policy", dest="schedulingPolicy",
+                        default="critical-path",
+                        help="Order of building ready packages: " +
+                        ", ".join(sorted(SchedulingPolicy.policies)) +
+                        " or module.ClassName of a custom SchedulingPolicy")
+    parser.add_argument("-kg", "--keep-going", dest="keepGoing",
+                        default=False, action="store_true",
+                        help="Keep building packages which don't depend on failed packages")
+    parser.add_argument("-wt", "--worker-type", dest="workerType",
+                        choices=['thread', 'process'], default="thread",
+                        help="Build packages in worker threads or in forked worker processes")
+    parser.add_argument("-tr", "--build-trace-path", dest="buildTracePath", default=None,
+                        help="Chrome trace event file of the build, "
+                             "build-trace.json in log path by default")
+    parser.add_argument("-lc", "--layer-cache-size", dest="layerCacheSize",
+                        default=20, type=float,
+                        help="Disk budget in GiB of toolchain snapshots and dependency layers "
+                             "kept by the snapshot build type, 0 disables dependency layers")
+    parser.add_argument("-rd", "--generate-repodata", dest="generateRepoData",
+                        default=False, action="store_true",
+                        help="Keep repodata of the RPMS path up to date while building")
+    parser.add_argument("-pf", "--prefetch-threads", dest="prefetchThreads",
+                        default=8, type=int,
+                        help="Number of concurrent downloads of the sources of all packages "
+                             "to build before building, 0 downloads them at build time")
     parser.add_argument("PackageName", nargs='?')
     options = parser.parse_args()
     cmdUtils = CommandUtils()
@@ -166,11 +212,28 @@ def main():
         constants.setPublishBuildDependencies(options.publishBuildDependencies)
         constants.setPackageWeightsPath(options.packageWeightsPath)
         constants.setKatBuild(options.katBuild)
+        constants.setSpecCachePath(options.specCachePath)
+        constants.setSourceCachePath(options.sourceCachePath)
+        constants.setBuildThreads(options.buildThreads)
+        constants.setBuildHistoryPath(options.buildHistoryPath)
+        constants.setSchedulingPolicy(options.schedulingPolicy)
+        constants.setKeepGoing(options.keepGoing)
+        constants.setWorkerType(options.workerType)
+        if options.buildTracePath is None:
+            options.buildTracePath = os.path.join(options.logPath, "build-trace.json")
+        constants.setBuildTracePath(options.buildTracePath)
+        constants.setLayerCacheSize(options.layerCacheSize)
+        constants.setGenerateRepoData(options.generateRepoData)
+        constants.setPrefetchThreads(options.prefetchThreads)
 
         constants.initialize()
         # parse SPECS folder
         SPECS()
-        if options.toolChainStage == "stage1":
+        if not options.simulate:
+            BuildTrace.initialize()
+        if options.simulate:
+            simulatePackages(options, logger)
+        elif options.toolChainStage == "stage1":
             pkgManager = PackageManager()
             pkgManager.buildToolChain()
         elif options.toolChainStage == "stage2":
@@ -184,11 +247,16 @@ def main():
         else:
             buildPackagesForAllSpecs(options.buildThreads, options.pkgBuildType,
                                      pkgInfoJsonFile, logger)
+        if options.updatePackageWeights and options.packageWeightsPath is not None:
+            BuildHistory.updatePackageWeights(options.buildHistoryPath,
+                                              options.packageWeightsPath, logger)
+        BuildTrace.write()
     except Exception as e:
         logger.error("Caught an exception")
         logger.error(str(e))
         # print stacktrace
         traceback.print_exc()
+        BuildTrace.write()
         sys.exit(1)
     sys.exit(0)
 
@@ -221,6 +289,20 @@ def buildPackagesForAllSpecs(buildThreads, pkgBuildType, pkgInfoJsonFile, logger
     buildSpecifiedPackages(listPackages, buildThreads, pkgBuildType, pkgInfoJsonFile, logger)
 
 
+def simulatePackages(options, logger):
+    if options.installPackage:
+        listPackages = [options.PackageName]
+    elif options.pkgJsonInput:
+        with open(options.pkgJsonInput) as jsonData:
+            listPackages = json.load(jsonData)["packages"]
+    else:
+        listPackages = SPECS.getData().getListPackages()
+    buildSimulator = BuildSimulator(durationsSource=options.simulate,
+                                    replayRun=options.replayRun)
+    makespan = buildSimulator.simulate(listPackages, options.buildThreads)
+    buildSimulator.printReport(makespan, options.buildThreads)
+
+
 def get_packages_with_build_options(pkg_build_options_file):
     if os.path.exists(pkg_build_options_file):
         with open(pkg_build_options_file) as jsonData:
@@ -18,6 +18,18 @@ class constants(object):
     sourceRpmPath = ""
     publishBuildDependencies = False
     packageWeightsPath = None
+    specCachePath = None
+    buildThreads = 1
+    buildHistoryPath = None
+    schedulingPolicy = "critical-path"
+    keepGoing = False
+    workerType = "thread"
+    buildTracePath = None
+    # Disk budget of toolchain snapshots and dependency layers in GiB
+    layerCacheSize = 20
+    generateRepoData = False
+    prefetchThreads = 8
+    sourceCachePath = None
     dockerUnixSocket = "/var/run/docker.sock"
     buildContainerImage = "photon_build_container:latest"
     userDefinedMacros = {}
@@ -384,6 +396,9 @@ class constants(object):
         urls.append(constants.pullsourcesURL)
         if packageName in constants.extrasourcesURLs:
             urls.extend(constants.extrasourcesURLs[packageName])
+        else:
+            # e.g. when prefetching, before the build sets them
+            urls.extend(constants.getAdditionalSourcesURLs(packageName))
         return urls
 
     @staticmethod
@@ -406,6 +421,50 @@ class constants(object):
     def setPackageWeightsPath(packageWeightsPath):
         constants.packageWeightsPath = packageWeightsPath
 
+    @staticmethod
+    def setSpecCachePath(specCachePath):
+        constants.specCachePath = specCachePath
+
+    @staticmethod
+    def setBuildThreads(buildThreads):
+        constants.buildThreads = buildThreads
+
+    @staticmethod
+    def setBuildHistoryPath(buildHistoryPath):
+        constants.buildHistoryPath = buildHistoryPath
+
+    @staticmethod
+    def setSchedulingPolicy(schedulingPolicy):
+        constants.schedulingPolicy = schedulingPolicy
+
+    @staticmethod
+    def setKeepGoing(keepGoing):
+        constants.keepGoing = keepGoing
+
+    @staticmethod
+    def setWorkerType(workerType):
+        constants.workerType = workerType
+
+    @staticmethod
+    def setBuildTracePath(buildTracePath):
+        constants.buildTracePath = buildTracePath
+
+    @staticmethod
+    def setLayerCacheSize(layerCacheSize):
+        constants.layerCacheSize = layerCacheSize
+
+    @staticmethod
+    def setGenerateRepoData(generateRepoData):
+        constants.generateRepoData = generateRepoData
+
+    @staticmethod
+    def setPrefetchThreads(prefetchThreads):
+        constants.prefetchThreads = prefetchThreads
+
+    @staticmethod
+    def setSourceCachePath(sourceCachePath):
+        constants.sourceCachePath = sourceCachePath
+
     @staticmethod
     def setDist(dist):
         constants.dist = dist
@@ -458,6 +517,12 @@ class constants(object):
     def setBuildOptions(options):
         constants.buildOptions = options
 
+    @staticmethod
+    def getAdditionalSourcesURLs(package):
+        if package in constants.buildOptions.keys():
+            return list(constants.buildOptions[package]["pullsources"])
+        return []
+
     @staticmethod
     def getAdditionalMacros(package):
         macros = {}
@@ -34,7 +34,10 @@ if [ ${EUID} -eq 0 ] ; then
     [ -e ${BUILDROOT}/dev/random ]	|| mknod -m 444 ${BUILDROOT}/dev/random c 1 8
     [ -e ${BUILDROOT}/dev/urandom ]	|| mknod -m 444 ${BUILDROOT}/dev/urandom c 1 9
 
-    chown -R 0:0 ${BUILDROOT}/*	|| fail "${PRGNAME}: Changing ownership: ${BUILDROOT}: FAILURE"
+#	Only touch files not owned by root yet: on a build root cloned from an
+#	overlayfs snapshot, chown would copy up every file of the snapshot.
+    find ${BUILDROOT} -mindepth 1 \( ! -user 0 -o ! -group 0 \) -exec chown -h 0:0 {} + \
+	|| fail "${PRGNAME}: Changing ownership: ${BUILDROOT}: FAILURE"
 
 #
 #	Mount kernel filesystem
@@ -0,0 +1,68 @@
+#!/bin/bash
+#################################################
+#	Title:	run-in-namespace.sh    			#
+#################################################
+#
+#	Runs a command in a build root from inside private user, mount
+#	and pid namespaces (see UserNamespaceChroot in Sandbox.py). All
+#	mounts live in the mount namespace only, so they go away with the
+#	last process of the command and never have to be unmounted.
+#
+set -o errexit
+set -o nounset
+set +h
+source common.inc
+
+PRGNAME=${0##*/}
+if [ $# -lt 7 ]; then
+    fail "${PRGNAME}: Usage : ${PRGNAME} <rpms> <srpms> <publishrpms> <publishxrpms> <inputrpms> <build-root> <command>"
+fi
+
+RPMS=$1
+shift
+SRPMS=$1
+shift
+PUBLISHRPMS=$1
+shift
+PUBLISHXRPMS=$1
+shift
+INPUTRPMS=$1
+shift
+BUILDROOT=$1
+shift
+PARENT=/usr/src/photon
+
+#
+#	Mount kernel filesystems and build directories
+#
+mount --rbind /dev ${BUILDROOT}/dev
+mount -t proc proc ${BUILDROOT}/proc
+mount --rbind /sys ${BUILDROOT}/sys
+mount -t tmpfs tmpfs ${BUILDROOT}/run
+mount --bind ${RPMS} ${BUILDROOT}${PARENT}/RPMS
+mount --bind ${SRPMS} ${BUILDROOT}${PARENT}/SRPMS
+mount -o ro --bind ${PUBLISHRPMS} ${BUILDROOT}/publishrpms
+mount -o ro --bind ${PUBLISHXRPMS} ${BUILDROOT}/publishxrpms
+if [ -n "${INPUTRPMS}" ]; then
+    mount -o ro --bind ${INPUTRPMS} ${BUILDROOT}/inputrpms
+fi
+# <lower>:<upper>:<work>:<directory of the build root> of file farms
+for FARM in ${FILE_FARMS:-}; do
+    IFS=: read -r LOWER UPPER WORK DEST <<< "${FARM}"
+    mount -t overlay overlay -o lowerdir=${LOWER},upperdir=${UPPER},workdir=${WORK} ${BUILDROOT}${DEST}
+done
+if [ -h ${BUILDROOT}/dev/shm ]; then mkdir -p ${BUILDROOT}/$(readlink ${BUILDROOT}/dev/shm); fi
+
+# Close all fds except stdin, stdout and stderr
+for fd in $(ls /proc/$$/fd/); do
+    [ $fd -gt 2 ] && exec {fd}<&-
+done
+
+exec chroot "${BUILDROOT}" \
+	/usr/bin/env -i \
+	HOME=/root \
+	TERM="${TERM:-}" \
+	PS1='\u:\w\$ ' \
+	PATH=/bin:/usr/bin:/sbin:/usr/sbin:/tools/bin \
+	SHELL=/bin/bash \
+	/bin/bash --login +h -c "$*"